@@ -0,0 +1,216 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows, peak RSS is not reported there
+    resource = None
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), "src")
+sys.path.insert(0, SOURCE_DIR)
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+
+def peak_rss_mib():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    if sys.platform == "darwin":
+        return round(peak / 1024 / 1024, 1)
+    return round(peak / 1024, 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              cwd=BENCHMARKS_DIR,
+                              capture_output=True,
+                              text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_dataset(dataset_path):
+    """Time the browser's hot paths on one dataset, in this process.
+
+    Runs the steps of opening a folder one by one, then filters, edits and
+    saves the whole dataset. Returns seconds per step.
+    """
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication([])
+    from imgbrowser import ImageBrowser
+
+    timings = {}
+
+    def timed(name, function, *args):
+        start = time.perf_counter()
+        function(*args)
+        timings[name] = round(time.perf_counter() - start, 6)
+        # Let queued work run outside of the timed call
+        app.processEvents()
+
+    browser = ImageBrowser()
+
+    # select_folder() without its dialog
+    def scan():
+        browser.folder_path = dataset_path
+        browser.dataset = browser.scanner.scan(dataset_path)
+
+    timed("scan", scan)
+    timed("load_images", browser.load_images)
+    timed("load_tags", browser.load_tags)
+    timed("initialize_all_tag_buttons", browser.initialize_all_tag_buttons)
+    timed("populate_tag_clouds", browser.populate_tag_clouds)
+
+    ranked = [tag for tag, _ in browser.image_tags.tag_counts().most_common()]
+
+    # The second most common tag but not the most common one, which hides
+    # most of the gallery, then every row shown again
+    browser.selected_positive_tags = {ranked[1]}
+    browser.selected_negative_tags = {ranked[0]}
+    timed("filter_gallery", browser.filter_gallery)
+    browser.selected_positive_tags = set()
+    browser.selected_negative_tags = set()
+    timed("filter_gallery_reset", browser.filter_gallery)
+
+    # Edits every image: the most common tag is swapped for a new one
+    browser.selected_tags_text_edit.setText(ranked[0])
+    browser.new_tags_text_edit.setText("benchmark_tag")
+    timed("apply_mass_edit", browser.apply_mass_edit)
+
+    browser.selected_tags_for_removal = {ranked[1]}
+    timed("remove_selected_tags_from_dataset",
+          browser.remove_selected_tags_from_dataset)
+
+    # Saving returns once the captions are handed to the writer thread
+    start = time.perf_counter()
+    timed("save_all_tags", browser.save_all_tags)
+    browser.caption_writer.wait()
+    timings["save_all_tags_written"] = round(time.perf_counter() - start, 6)
+
+    result = {
+        "images": len(browser.dataset.image_files),
+        "tags": len(ranked),
+        "timings": timings,
+        "peak_rss_mib": peak_rss_mib(),
+    }
+    browser.close()
+    return result
+
+
+def run_child(dataset_path, result_path):
+    result = benchmark_dataset(dataset_path)
+    with open(result_path, "w") as file:
+        json.dump(result, file)
+
+
+def run_scale(images, args, dataset_options):
+    """Benchmark a fresh copy of the dataset of the given size in a new
+    process, so its peak RSS is its own."""
+    from synthetic import cached_dataset, copy_dataset
+
+    pristine = cached_dataset(args.work_dir, images, **dataset_options)
+    with tempfile.TemporaryDirectory(dir=args.work_dir) as run_dir:
+        dataset_path = copy_dataset(pristine, os.path.join(run_dir, "data"))
+        result_path = os.path.join(run_dir, "result.json")
+        # An empty cache, so captions are read instead of a snapshot
+        environment = dict(os.environ,
+                           TAGGER_CACHE_DIR=os.path.join(run_dir, "cache"))
+        subprocess.run([
+            sys.executable, __file__, "--child", dataset_path, "--result",
+            result_path
+        ],
+                       env=environment,
+                       stdout=subprocess.DEVNULL,
+                       check=True)
+        with open(result_path) as file:
+            return json.load(file)
+
+
+def print_summary(results):
+    steps = list(results[0]["timings"])
+    width = max(map(len, steps))
+    print(f"{'':{width}}" + "".join(f"{r['images']:>12}" for r in results))
+    for step in steps:
+        print(f"{step:{width}}" + "".join(f"{r['timings'][step]:>11.3f}s"
+                                          for r in results))
+    print(f"{'peak RSS (MiB)':{width}}" +
+          "".join(f"{r['peak_rss_mib'] or 0:>12.0f}" for r in results))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time the tagger's hot paths on synthetic datasets.")
+    parser.add_argument("--scales",
+                        type=int,
+                        nargs="+",
+                        default=[1000, 10000, 100000],
+                        help="dataset sizes in images")
+    parser.add_argument("--width", type=int, default=64)
+    parser.add_argument("--height", type=int, default=64)
+    parser.add_argument("--vocabulary",
+                        type=int,
+                        default=5000,
+                        help="number of distinct tags")
+    parser.add_argument("--exponent",
+                        type=float,
+                        default=1.0,
+                        help="exponent of the Zipf tag distribution")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir",
+                        default=os.path.join(tempfile.gettempdir(),
+                                             "tagger-benchmarks"),
+                        help="where datasets are generated and kept")
+    parser.add_argument("--output", help="JSON file to write the results to")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.result)
+        return
+
+    from PyQt5.QtCore import QT_VERSION_STR
+    from PyQt5.QtGui import QGuiApplication
+    app = QGuiApplication([])  # For encoding the images
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    dataset_options = {
+        "width": args.width,
+        "height": args.height,
+        "vocabulary": args.vocabulary,
+        "exponent": args.exponent,
+        "seed": args.seed,
+    }
+    results = []
+    for images in args.scales:
+        print(f"Benchmarking {images} images...", file=sys.stderr)
+        results.append(run_scale(images, args, dataset_options))
+
+    report = {
+        "commit": git_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "qt": QT_VERSION_STR,
+        "platform": platform.platform(),
+        "dataset": dataset_options,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    print_summary(results)
+
+
+if __name__ == "__main__":
+    main()
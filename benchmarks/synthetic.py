@@ -0,0 +1,91 @@
+import os
+import random
+import shutil
+from itertools import accumulate
+
+from PyQt5.QtCore import QBuffer, QIODevice
+from PyQt5.QtGui import QColor, QImage
+
+# Distinct images written; the rest of the dataset repeats their bytes, so a
+# 100k image dataset does not take hours to encode
+_IMAGE_VARIANTS = 16
+
+
+def zipf_vocabulary(size, exponent):
+    """size tags and their cumulative Zipf weights, most common first."""
+    tags = [f"tag_{rank:05d}" for rank in range(size)]
+    weights = [1 / (rank + 1)**exponent for rank in range(size)]
+    return tags, list(accumulate(weights))
+
+
+def encode_png(width, height, color):
+    image = QImage(width, height, QImage.Format_RGB32)
+    image.fill(color)
+    buffer = QBuffer()
+    buffer.open(QIODevice.WriteOnly)
+    image.save(buffer, "PNG")
+    return bytes(buffer.data())
+
+
+def generate_dataset(path,
+                     images,
+                     width=64,
+                     height=64,
+                     vocabulary=5000,
+                     exponent=1.0,
+                     min_tags=5,
+                     max_tags=30,
+                     seed=0):
+    """Write images PNGs with .txt captions into path.
+
+    Every caption draws between min_tags and max_tags tags from a Zipf
+    distributed vocabulary, so a few tags are on most images and most tags
+    on a few, as in real datasets. The same arguments always give the same
+    dataset. Needs a QApplication for the image encoding.
+    """
+    os.makedirs(path, exist_ok=True)
+    rng = random.Random(seed)
+    tags, cumulative_weights = zipf_vocabulary(vocabulary, exponent)
+    variants = [
+        encode_png(width, height,
+                   QColor.fromHsv(hue * 360 // _IMAGE_VARIANTS, 160, 200))
+        for hue in range(_IMAGE_VARIANTS)
+    ]
+    digits = len(str(images - 1))
+    for index in range(images):
+        name = f"image_{index:0{digits}d}"
+        with open(os.path.join(path, name + ".png"), "wb") as file:
+            file.write(variants[index % _IMAGE_VARIANTS])
+        # Drawing with replacement, so common tags repeat and the caption
+        # ends up with fewer distinct tags than drawn
+        caption = dict.fromkeys(
+            rng.choices(tags,
+                        cum_weights=cumulative_weights,
+                        k=rng.randint(min_tags, max_tags)))
+        with open(os.path.join(path, name + ".txt"), "w",
+                  encoding="utf-8") as file:
+            file.write(", ".join(caption))
+
+
+def cached_dataset(directory, images, **options):
+    """Path of a pristine dataset under directory, generated on first use.
+
+    The dataset is keyed by its arguments. A run edits and saves its
+    captions, so it should work on a copy_dataset() of it.
+    """
+    key = "-".join(
+        [f"zipf{images}"] +
+        [f"{name}{value}" for name, value in sorted(options.items())])
+    path = os.path.join(directory, key)
+    if not os.path.isdir(path):
+        partial = path + ".partial"
+        shutil.rmtree(partial, ignore_errors=True)
+        generate_dataset(partial, images, **options)
+        os.replace(partial, path)
+    return path
+
+
+def copy_dataset(source, destination):
+    shutil.rmtree(destination, ignore_errors=True)
+    shutil.copytree(source, destination)
+    return destination
@@ -0,0 +1,82 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+_CHUNK_SIZE = 256  # Caption files read per pool task
+
+log = logging.getLogger(__name__)
+
+
+def parse_caption(text):
+    # Strip whitespace from each tag, the set removes duplicates. An empty
+    # caption has no tags rather than the tag "", as in a manifest
+    tags = set(map(str.strip, text.strip().split(",")))
+    tags.discard("")
+    return tags
+
+
+def read_caption(tag_file_path):
+    with open(tag_file_path, "r") as file:
+        return parse_caption(file.read())
+
+
+def _read_chunk(chunk, cancel_event):
+    tags = {}
+    for image_file, tag_file_path in chunk:
+        if cancel_event.is_set():
+            break
+        try:
+            tags[image_file] = read_caption(tag_file_path)
+        except OSError as e:
+            log.error("Error loading tags for %s: %s", image_file, e)
+    return tags
+
+
+class CaptionLoader:
+    """Reads caption files on a bounded thread pool.
+
+    Files are read in chunks so the pool overhead stays small next to the
+    I/O. load() returns one dict with every caption, which the caller merges
+    in a single step, or None when it was cancelled.
+    """
+
+    def __init__(self, workers):
+        self.workers = max(1, workers)
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def load(self, items, progress=None, encode=None):
+        """items: list of (image_file, tag_file_path); progress is called with
+        (files_done, files_total) from the calling thread. encode, when given,
+        converts each tag set on the calling thread as its chunk arrives, so
+        the sets of strings do not pile up until the end."""
+        self.cancel_event.clear()
+        chunks = [
+            items[i:i + _CHUNK_SIZE] for i in range(0, len(items), _CHUNK_SIZE)
+        ]
+        results = {}
+        done = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                executor.submit(_read_chunk, chunk, self.cancel_event):
+                len(chunk)
+                for chunk in chunks
+            }
+            for future in as_completed(futures):
+                chunk_tags = future.result()
+                if encode is not None:
+                    chunk_tags = {
+                        image_file: encode(tags)
+                        for image_file, tags in chunk_tags.items()
+                    }
+                results.update(chunk_tags)
+                done += futures[future]
+                if progress is not None:
+                    progress(done, len(items))
+                if self.cancel_event.is_set():
+                    for pending in futures:
+                        pending.cancel()
+                    return None
+        return results
@@ -0,0 +1,184 @@
+import os
+import tempfile
+
+from PyQt5.QtCore import (QCoreApplication, QEvent, QObject, QRunnable,
+                          QThreadPool, Qt, pyqtSignal)
+
+import perf
+
+_BATCH = 128  # Captions written per group of fsyncs, files open at once
+
+# New caption files get the permissions open() would have given them
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def fsync_directory(directory):
+    # Makes the renames durable; directories cannot be opened on Windows
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def file_mode(path):
+    # Permissions for a new version of path: those of the current one, or
+    # what open() would give a new file
+    try:
+        return os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        return 0o666 & ~_UMASK
+
+
+def _discard(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def write_captions(jobs):
+    """Write (key, path, text) jobs so that each file is either the old or
+    the new caption, even after a crash.
+
+    Every text goes to a temp file next to its caption. Only when all of
+    them are written are they fsynced, renamed over the captions with
+    os.replace, and each directory fsynced once for all its renames.
+    Returns [(key, stat)] of the written captions and [(key, error)] of
+    the failed ones.
+    """
+    written = []
+    failed = []
+    temp_files = []
+    for key, path, text in jobs:
+        directory = os.path.dirname(path) or "."
+        prefix = "." + os.path.basename(path) + "."
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=directory,
+                                             prefix=prefix,
+                                             suffix=".tmp")
+        except OSError as e:
+            failed.append((key, str(e)))
+            continue
+        file = os.fdopen(fd, "w")
+        try:
+            file.write(text)
+            file.flush()
+            os.chmod(temp_path, file_mode(path))
+        except (OSError, ValueError) as e:  # ValueError: unencodable text
+            file.close()
+            _discard(temp_path)
+            failed.append((key, str(e)))
+            continue
+        temp_files.append((key, path, temp_path, file))
+
+    # The whole batch is written before the first fsync, so the kernel can
+    # flush the files together instead of one at a time
+    directories = set()
+    for key, path, temp_path, file in temp_files:
+        try:
+            with file:
+                os.fsync(file.fileno())
+            os.replace(temp_path, path)
+            written.append((key, os.stat(path)))
+            directories.add(os.path.dirname(path) or ".")
+        except OSError as e:
+            failed.append((key, str(e)))
+            _discard(temp_path)
+    for directory in directories:
+        fsync_directory(directory)
+    return written, failed
+
+
+class CaptionWriteTask(QRunnable):
+    """Writes one save's captions, batch by batch, on the writer thread."""
+
+    def __init__(self, writer, context, jobs, write_batch, batch_size):
+        super().__init__()
+        self.writer = writer
+        self.context = context
+        self.jobs = jobs
+        self.write_batch = write_batch
+        self.batch_size = max(1, batch_size)
+
+    def run(self):
+        done = 0
+        total_failed = 0
+        for start in range(0, len(self.jobs), self.batch_size):
+            batch = self.jobs[start:start + self.batch_size]
+            with perf.span("save.write", captions=len(batch)):
+                written, failed = self.write_batch(batch)
+            done += len(batch)
+            total_failed += len(failed)
+            self.writer._written.emit(self.context, written, failed, done,
+                                      len(self.jobs))
+        self.writer._finished.emit(self.context,
+                                   len(self.jobs) - total_failed, total_failed)
+
+
+class CaptionWriter(QObject):
+    """Saves captions on a background thread.
+
+    write() takes a list of (key, path, text), already rendered on the
+    calling thread, so the caller may go on changing its tags while the
+    files are written. Saves run one after the other in the order they
+    were started. Results come back on the GUI thread: saved and failed
+    per file, progress per batch and finished once per save, each with
+    the context the save was started with.
+
+    write_batch, write_captions() by default, is called with the jobs in
+    batches of batch_size and returns the written and failed ones the same
+    way.
+    """
+
+    saved = pyqtSignal(object, object)  # context, [(key, stat or None)]
+    failed = pyqtSignal(object, str, str)  # context, key, error
+    progress = pyqtSignal(int, int)  # captions done, total of the save
+    finished = pyqtSignal(object, int, int)  # context, written, failed
+    _written = pyqtSignal(object, object, object, int, int)
+    _finished = pyqtSignal(object, int, int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)  # Keeps the saves in order
+        self.running = 0
+        self._written.connect(self._on_written, Qt.QueuedConnection)
+        self._finished.connect(self._on_finished, Qt.QueuedConnection)
+
+    def write(self,
+              jobs,
+              context=None,
+              write_batch=write_captions,
+              batch_size=_BATCH):
+        self.running += 1
+        self.pool.start(
+            CaptionWriteTask(self, context, list(jobs), write_batch,
+                             batch_size))
+
+    def is_running(self):
+        return self.running > 0
+
+    def wait(self):
+        # Blocks until every save is written and its results delivered
+        self.pool.waitForDone()
+        # The queued results are posted to PyQt's proxy of the slots rather
+        # than to this object, so every queued call is delivered
+        QCoreApplication.sendPostedEvents(None, QEvent.MetaCall)
+
+    def _on_written(self, context, written, failed, done, total):
+        if written:
+            self.saved.emit(context, written)
+        for key, error in failed:
+            self.failed.emit(context, key, error)
+        self.progress.emit(done, total)
+
+    def _on_finished(self, context, written, failed):
+        self.running -= 1
+        self.finished.emit(context, written, failed)
@@ -0,0 +1,197 @@
+import logging
+import os
+import struct
+import hashlib
+import tempfile
+from array import array
+
+try:
+    import zstandard
+except ImportError:  # Snapshots are stored uncompressed without zstandard
+    zstandard = None
+
+# Version 2 rows have no "" tag for empty captions, older snapshots are read
+# again
+_MAGIC = b"TDX2"
+_RAW_MAGIC = b"TDR2"
+# magic, vocabulary size, image count, then the byte length of each section:
+# folder, vocabulary, image files, mtimes, sizes, offsets, tag ids
+_HEADER = struct.Struct("<4sII7Q")
+_SEPARATOR = b"\0"
+
+log = logging.getLogger(__name__)
+
+
+def _join(strings):
+    return _SEPARATOR.join(
+        string.encode("utf-8", "surrogatepass") for string in strings)
+
+
+def _split(data, count):
+    if not count:
+        return []
+    return [
+        part.decode("utf-8", "surrogatepass")
+        for part in data.split(_SEPARATOR)
+    ]
+
+
+class DatasetSnapshot:
+    """Captions of one dataset folder as they were last read from disk.
+
+    For every image with a caption file it keeps the caption's mtime and
+    size; rows holds the parsed tags as ids into tags, CSR style like
+    TagTable. A caption is only read again when its mtime or size changed.
+    A snapshot built up with set_stamp() has no rows; it is written out
+    with the rows of a TagTable.
+    """
+
+    def __init__(self, folder_path):
+        self.folder_path = folder_path
+        self.tags = []  # Vocabulary the rows refer to
+        self.image_files = []
+        self.positions = {}  # image file -> index
+        self.mtimes = array('q')
+        self.sizes = array('q')
+        self.offsets = array('Q', [0])
+        self.tag_ids = array('I')
+
+    def __len__(self):
+        return len(self.image_files)
+
+    def row(self, image_file, stat):
+        """Tag ids of image_file if its caption is unchanged, else None."""
+        index = self.positions.get(image_file)
+        if (index is None or self.mtimes[index] != stat.st_mtime_ns
+                or self.sizes[index] != stat.st_size
+                or len(self.offsets) == 1):
+            return None
+        return self.tag_ids[self.offsets[index]:self.offsets[index + 1]]
+
+    def set_stamp(self, image_file, stat):
+        index = self.positions.get(image_file)
+        if index is None:
+            self.positions[image_file] = len(self.image_files)
+            self.image_files.append(image_file)
+            self.mtimes.append(stat.st_mtime_ns)
+            self.sizes.append(stat.st_size)
+        else:
+            self.mtimes[index] = stat.st_mtime_ns
+            self.sizes[index] = stat.st_size
+
+    def invalidate(self, image_file):
+        # Forces the caption to be read again on the next open
+        index = self.positions.get(image_file)
+        if index is not None:
+            self.mtimes[index] = -1
+
+
+class DatasetIndex:
+    """Stores a DatasetSnapshot per folder under directory, so reopening a
+    folder reads one compressed file instead of every caption in it.
+
+    Snapshots are keyed by the absolute folder path. A missing, damaged or
+    foreign snapshot just loads as None and every caption is read.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _snapshot_path(self, folder_path):
+        key = os.fsencode(os.path.abspath(folder_path))
+        return os.path.join(self.directory,
+                            hashlib.sha1(key).hexdigest() + ".idx")
+
+    def load(self, folder_path):
+        try:
+            with open(self._snapshot_path(folder_path), "rb") as file:
+                data = file.read()
+            return self._decode(data, folder_path)
+        except Exception:
+            return None
+
+    def save(self, snapshot, table):
+        """Write snapshot's stamps with the current rows of table, a
+        TagTable holding every image file of the snapshot."""
+        try:
+            data = self._encode(snapshot, table)
+            os.makedirs(self.directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.replace(temp_path, self._snapshot_path(snapshot.folder_path))
+        except OSError as e:
+            log.error("Error saving the dataset index: %s", e)
+
+    def _encode(self, snapshot, table):
+        offsets = array('Q', [0])
+        tag_ids = array('I')
+        for image_file in snapshot.image_files:
+            try:
+                tag_ids.extend(table.row(image_file))
+            except KeyError:  # Caption that failed to load
+                pass
+            offsets.append(len(tag_ids))
+        tags = table.vocabulary.tags
+        used = set(tag_ids)
+        if len(used) < len(tags):
+            # Leave out tags no image carries any more, so the vocabulary
+            # does not keep growing from one session to the next
+            kept = sorted(used)
+            new_ids = {tag_id: new_id for new_id, tag_id in enumerate(kept)}
+            tag_ids = array('I', map(new_ids.__getitem__, tag_ids))
+            tags = [tags[tag_id] for tag_id in kept]
+        sections = [
+            _join([os.path.abspath(snapshot.folder_path)]),
+            _join(tags),
+            _join(snapshot.image_files),
+            snapshot.mtimes.tobytes(),
+            snapshot.sizes.tobytes(),
+            offsets.tobytes(),
+            tag_ids.tobytes(),
+        ]
+        payload = b"".join(sections)
+        magic = _RAW_MAGIC
+        if zstandard is not None:
+            magic = _MAGIC
+            payload = zstandard.ZstdCompressor(level=3).compress(payload)
+        return _HEADER.pack(magic, len(tags), len(snapshot.image_files),
+                            *map(len, sections)) + payload
+
+    def _decode(self, data, folder_path):
+        magic, tag_count, image_count, *lengths = _HEADER.unpack_from(data)
+        payload = data[_HEADER.size:]
+        if magic == _MAGIC and zstandard is not None:
+            payload = zstandard.ZstdDecompressor().decompress(
+                payload, max_output_size=sum(lengths))
+        elif magic != _RAW_MAGIC:
+            return None
+        sections = []
+        position = 0
+        for length in lengths:
+            sections.append(payload[position:position + length])
+            position += length
+        (folder, tags, image_files, mtimes, sizes, offsets, tag_ids) = sections
+        if _split(folder, 1) != [os.path.abspath(folder_path)]:
+            return None
+
+        snapshot = DatasetSnapshot(folder_path)
+        snapshot.tags = _split(tags, tag_count)
+        snapshot.image_files = _split(image_files, image_count)
+        snapshot.positions = {
+            image_file: index
+            for index, image_file in enumerate(snapshot.image_files)
+        }
+        snapshot.mtimes = array('q', mtimes)
+        snapshot.sizes = array('q', sizes)
+        snapshot.offsets = array('Q', offsets)
+        snapshot.tag_ids = array('I', tag_ids)
+        if (len(snapshot.tags) != tag_count
+                or len(snapshot.image_files) != image_count
+                or len(snapshot.mtimes) != image_count
+                or len(snapshot.sizes) != image_count
+                or len(snapshot.offsets) != image_count + 1
+                or snapshot.offsets[-1] != len(snapshot.tag_ids)
+                or max(snapshot.tag_ids, default=0) >= max(tag_count, 1)):
+            return None
+        return snapshot
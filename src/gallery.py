@@ -0,0 +1,219 @@
+import os
+
+from PyQt5.QtWidgets import QListView, QStyledItemDelegate
+from PyQt5.QtCore import (Qt, QAbstractListModel, QModelIndex, QRect, QSize,
+                          QTimer)
+from PyQt5.QtGui import QColor, QPainter, QPen
+
+from tagindex import iter_ids
+import perf
+
+ImagePathRole = Qt.UserRole
+
+
+class GalleryModel(QAbstractListModel):
+    """Flat list of the image paths shown in the gallery."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.image_paths = []
+        self.rows = {}  # image_path -> row
+
+    def set_images(self, image_paths):
+        self.beginResetModel()
+        self.image_paths = list(image_paths)
+        self.rows = {path: row for row, path in enumerate(self.image_paths)}
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.image_paths)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        image_path = self.image_paths[index.row()]
+        if role == ImagePathRole:
+            return image_path
+        if role in (Qt.DisplayRole, Qt.ToolTipRole):
+            return os.path.basename(image_path)
+        return None
+
+    def row_of(self, image_path):
+        return self.rows.get(image_path, -1)
+
+    def refresh_image(self, image_path):
+        # Repaint a single tile, e.g. when its thumbnail arrives
+        row = self.rows.get(image_path)
+        if row is not None:
+            index = self.index(row)
+            self.dataChanged.emit(index, index)
+
+
+def row_range(first, last):
+    """Bitmap of the rows from first to last, in either order."""
+    if first > last:
+        first, last = last, first
+    return ((1 << (last + 1)) - 1) ^ ((1 << first) - 1)
+
+
+class GallerySelection:
+    """Selected gallery rows, kept as one int bitmap like the tag filter.
+
+    Selecting all visible images or a shift-click range is a single OR
+    with a bitmap, and the delegate tests one bit per painted tile, so
+    nothing is done per selected image. As a container it still holds
+    image paths, like the set it replaces. A model reset clears it.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.bits = 0
+        model.modelReset.connect(self.clear)
+
+    def __len__(self):
+        return self.bits.bit_count()
+
+    def __bool__(self):
+        return bool(self.bits)
+
+    def __contains__(self, image_path):
+        row = self.model.rows.get(image_path)
+        return row is not None and self.is_row_selected(row)
+
+    def __iter__(self):
+        image_paths = self.model.image_paths
+        for row in iter_ids(self.bits):
+            yield image_paths[row]
+
+    def is_row_selected(self, row):
+        return (self.bits >> row) & 1 == 1
+
+    def select_rows(self, bitmap):
+        self.bits |= bitmap
+
+    def deselect_rows(self, bitmap):
+        self.bits &= ~bitmap
+
+    def keep_only(self, row):
+        # Deselect every row but row, which stays selected if it was; a
+        # negative row deselects everything
+        self.bits &= 1 << row if row >= 0 else 0
+
+    def add(self, image_path):
+        self.bits |= 1 << self.model.rows[image_path]
+
+    def discard(self, image_path):
+        row = self.model.rows.get(image_path)
+        if row is not None:
+            self.bits &= ~(1 << row)
+
+    def remove(self, image_path):
+        if image_path not in self:
+            raise KeyError(image_path)
+        self.discard(image_path)
+
+    def clear(self):
+        self.bits = 0
+
+
+class GalleryDelegate(QStyledItemDelegate):
+    """Paints a gallery tile: the thumbnail and the selection border.
+
+    Thumbnails come from thumbnail_for(image_path), which returns None while
+    the image is still being decoded, and are scaled to the tile size here.
+    Since Qt only paints the tiles inside the viewport, only those
+    thumbnails are ever requested.
+    """
+
+    def __init__(self, thumbnail_for, is_row_selected, parent=None):
+        super().__init__(parent)
+        self.thumbnail_for = thumbnail_for
+        self.is_row_selected = is_row_selected
+        self.thumbnail_size = 200
+        self.smooth_scaling = True  # Turned off for the slider preview
+
+    def sizeHint(self, option, index):
+        return QSize(self.thumbnail_size + 10, self.thumbnail_size + 10)
+
+    def paint(self, painter, option, index):
+        image_path = index.data(ImagePathRole)
+        tile = QRect(0, 0, self.thumbnail_size + 10, self.thumbnail_size + 10)
+        tile.moveCenter(option.rect.center())
+
+        pixmap = self.thumbnail_for(image_path)
+        perf.count("gallery.tiles_painted")
+        if pixmap is None:
+            perf.count("gallery.placeholders_painted")
+            # Placeholder until the worker pool delivers the thumbnail
+            painter.fillRect(tile.adjusted(5, 5, -5, -5), QColor("#2E2E2E"))
+        else:
+            # The pixmap is a mip level, scale it to the current tile size
+            target = QRect(0, 0, 0, 0)
+            target.setSize(pixmap.size().scaled(self.thumbnail_size,
+                                                self.thumbnail_size,
+                                                Qt.KeepAspectRatio))
+            target.moveCenter(tile.center())
+            painter.save()
+            painter.setRenderHint(QPainter.SmoothPixmapTransform,
+                                  self.smooth_scaling)
+            painter.drawPixmap(target, pixmap)
+            painter.restore()
+
+        if self.is_row_selected(index.row()):
+            pen = QPen(QColor("grey"), 6)
+            pen.setJoinStyle(Qt.MiterJoin)
+            painter.setPen(pen)
+            painter.setBrush(Qt.NoBrush)
+            painter.drawRect(tile.adjusted(3, 3, -3, -3))
+
+
+class GalleryView(QListView):
+    """Icon mode list view with uniform tiles; Qt lays out and paints only
+    what is inside the viewport, however many images the folder has.
+
+    Resizing never touches the model: it only recomputes the column count
+    and reflows the existing tiles, at most once per event loop iteration.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.thumbnail_size = 200
+        self.setViewMode(QListView.IconMode)
+        self.setMovement(QListView.Static)
+        self.setFlow(QListView.LeftToRight)
+        self.setWrapping(True)
+        self.setResizeMode(QListView.Fixed)  # Reflow is done by reflow()
+        self.setUniformItemSizes(True)
+        self.setLayoutMode(QListView.Batched)
+        self.setBatchSize(1000)
+        self.setSelectionMode(QListView.NoSelection)
+        self.setEditTriggers(QListView.NoEditTriggers)
+        self.setVerticalScrollMode(QListView.ScrollPerPixel)
+
+        # Splitter drags and window resizes send bursts of resize events,
+        # the zero timer folds them into a single reflow
+        self.reflow_timer = QTimer(self)
+        self.reflow_timer.setSingleShot(True)
+        self.reflow_timer.setInterval(0)
+        self.reflow_timer.timeout.connect(self.reflow)
+
+    def set_thumbnail_size(self, size):
+        self.thumbnail_size = size
+        self.itemDelegate().thumbnail_size = size
+        self.reflow()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.reflow_timer.start()
+
+    def reflow(self):
+        # Same column count as the old grid: one column per thumbnail + 20px,
+        # with the spare width spread over the columns
+        cell = self.thumbnail_size + 20
+        width = self.viewport().width()
+        columns = max(1, width // cell)
+        grid_size = QSize(max(cell, width // columns), cell)
+        if grid_size != self.gridSize():
+            self.setGridSize(grid_size)
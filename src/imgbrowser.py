@@ -1,15 +1,37 @@
 import sys
 import os
-from PyQt5.QtWidgets import QApplication, QMainWindow, QSplitter, QVBoxLayout, QWidget, QFileDialog, QLabel, QScrollArea, QSlider, QHBoxLayout, QGridLayout, QPushButton, QFrame, QGroupBox, QTabWidget, QLayout, QTextEdit, QCheckBox, QLineEdit
+from PyQt5.QtWidgets import QApplication, QMainWindow, QSplitter, QVBoxLayout, QWidget, QFileDialog, QLabel, QScrollArea, QSlider, QHBoxLayout, QGridLayout, QPushButton, QFrame, QGroupBox, QTabWidget, QLayout, QTextEdit, QCheckBox, QLineEdit, QProgressDialog, QShortcut
 from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtCore import QRect, QSize, QPoint
-from PyQt5.QtGui import QPixmap
-import traceback
-from datetime import datetime
-from sortedcontainers import SortedDict
-
-from scrollarea import CustomScrollArea
-from layout import FlowLayout
+from PyQt5.QtGui import QKeySequence, QPixmap
+import logging
+from collections import Counter
+from sortedcontainers import SortedKeyList
+
+from tagcloud import TagCloudModel, TagCloudView
+from tagsearch import TagSearchIndex
+from gallery import (GalleryModel, GalleryDelegate, GallerySelection,
+                     GalleryView, ImagePathRole, row_range)
+from thumbnails import ThumbnailLoader, MIP_LEVELS, mip_level
+from thumbcache import ThumbnailDiskCache
+from pixmapcache import PixmapCache
+from scanner import DatasetScanner
+from captions import CaptionLoader
+from tagindex import TagIndex, iter_ids
+from tagstats import TagStatistics
+from tagedit import TagEditTransaction
+from tagstore import TagTable
+from tagdb import SqliteTagTable, SqliteTagIndex
+from tagquery import TagQuery, QueryError
+from datasetindex import DatasetIndex, DatasetSnapshot
+from captionwriter import CaptionWriter
+from manifest import CaptionManifest
+from perf import PerfOverlay
+from watchdog import StallWatchdog
+import perf
+import settings
+
+log = logging.getLogger(__name__)
 
 
 class ImageBrowser(QMainWindow):
@@ -17,12 +39,33 @@ class ImageBrowser(QMainWindow):
     def __init__(self):
         super().__init__()
 
-        self.image_frames = {}  # Dictionary to store image frames
-        self.edited_tags = {}
+        self.edited_tags = set()  # Image files with unsaved tag changes
+        # Image files being written by caption_writer, with the number of
+        # saves they are part of
+        self.saving_tags = Counter()
         self.single_selection_mode = False
         self.selected_tags_for_removal = set()
         self.selected_tags = set()
-        self.tag_buttons_dict = SortedDict()
+        # Tags ordered by descending image count; the key reads
+        # tag_sort_counts, so a tag is removed before its count changes
+        self.tag_sort_counts = {}
+        self.sorted_tags = SortedKeyList(
+            key=lambda tag: -self.tag_sort_counts.get(tag, 0))
+
+        # Substring index over the tag vocabulary for the filter boxes
+        self.tag_search = TagSearchIndex()
+
+        # One model per tag cloud, each with its own checked tags
+        self.positive_tag_model = TagCloudModel()
+        self.positive_tag_model.toggled.connect(self.toggle_tag)
+        self.negative_tag_model = TagCloudModel()
+        self.negative_tag_model.toggled.connect(
+            lambda tag, state: self.toggle_tag(tag, state, negative=True))
+        self.removal_tag_model = TagCloudModel()
+        self.removal_tag_model.toggled.connect(self.toggle_tag_for_removal)
+        self.edit_tag_model = TagCloudModel(show_counts=False)
+        self.edit_tag_model.toggled.connect(
+            lambda tag, state: self.add_tag_to_edit(tag))
         self.editing_tags_buttons = []
 
         # Initialize the timer
@@ -31,12 +74,47 @@ class ImageBrowser(QMainWindow):
 
         self.folder_path = ""
         self.thumbnail_size = 200
-        self.selected_images = set()
-        self.original_pixmaps = {}  # Dictionary to store original images
+        # Decoded thumbnails per (image_path, mip level), bounded by a budget
+        self.pixmap_cache = PixmapCache(settings.PIXMAP_CACHE_MB * 1024 * 1024)
         self.selected_positive_tags = set()
         self.selected_negative_tags = set()
-        self.image_tags = {}
+        self.image_tags = TagTable()  # image file -> tags, as tag ids
+        self.image_ids = {}  # image file -> gallery row, used as image id
+        self.tag_index = TagIndex()  # tag -> bitmap of image ids
+        self.tag_stats = TagStatistics()  # tag -> number of images
+        self.visible_images = 0  # bitmap of the rows passing the tag filter
+        self.gallery_query = None  # TagQuery typed into the query box
         self.current_image_path = None
+        self.scanner = DatasetScanner()
+        self.dataset = None  # DatasetScan of the open folder
+        self.caption_loader = CaptionLoader(settings.CAPTION_WORKERS)
+        # Parsed captions of every opened folder, kept between sessions
+        self.dataset_index = None
+        if settings.DATASET_INDEX:
+            self.dataset_index = DatasetIndex(
+                os.path.join(settings.CACHE_DIR, "datasets"))
+        self.dataset_snapshot = None  # Caption stamps of the open folder
+        self.snapshot_stale = False  # Saved captions not in the stored one
+        self.manifest = None  # CaptionManifest of the open folder, if any
+
+        # Captions are saved on a background thread
+        self.caption_writer = CaptionWriter(self)
+        self.caption_writer.saved.connect(self.on_captions_saved)
+        self.caption_writer.failed.connect(self.on_caption_save_failed)
+        self.caption_writer.progress.connect(self.on_save_progress)
+        self.caption_writer.finished.connect(self.on_save_finished)
+
+        # Thumbnails are decoded off the GUI thread and delivered as they
+        # finish
+        disk_cache = None
+        if settings.THUMBNAIL_CACHE_MB > 0:
+            disk_cache = ThumbnailDiskCache(
+                os.path.join(settings.CACHE_DIR, "thumbnails"),
+                settings.THUMBNAIL_CACHE_MB * 1024 * 1024)
+        self.thumbnail_loader = ThumbnailLoader(settings.THUMBNAIL_WORKERS,
+                                                disk_cache, self)
+        self.thumbnail_loader.thumbnail_loaded.connect(
+            self.on_thumbnail_loaded)
 
         main_layout = QVBoxLayout()
 
@@ -52,14 +130,19 @@ class ImageBrowser(QMainWindow):
 
         # Middle Section: Splitter for Image Gallery and Tag/Edit Area
         splitter = QSplitter(Qt.Horizontal)
-        self.images_panel = QWidget()
-        self.images_layout = QGridLayout()
-        self.images_layout.setSpacing(0)
-        self.images_panel.setLayout(self.images_layout)
-        self.scroll_area = CustomScrollArea(self)
-        self.scroll_area.setWidgetResizable(True)
-        self.scroll_area.setWidget(self.images_panel)
-        splitter.addWidget(self.scroll_area)
+        self.gallery_model = GalleryModel(self)
+        # Selected images, a bitmap over the gallery rows
+        self.selected_images = GallerySelection(self.gallery_model)
+        self.selection_anchor = None  # Row shift-click ranges start from
+        self.gallery_view = GalleryView()
+        self.gallery_delegate = GalleryDelegate(self.thumbnail_for,
+                                                self.is_image_selected,
+                                                self.gallery_view)
+        self.gallery_view.setItemDelegate(self.gallery_delegate)
+        self.gallery_view.setModel(self.gallery_model)
+        self.gallery_view.set_thumbnail_size(self.thumbnail_size)
+        self.gallery_view.pressed.connect(self.on_gallery_pressed)
+        splitter.addWidget(self.gallery_view)
 
         # Right Part (Tag Selector and Sub-Menu)
         self.tag_edit_area = QWidget()
@@ -79,20 +162,45 @@ class ImageBrowser(QMainWindow):
         self.thumbnail_slider.setMaximum(2000)
         self.thumbnail_slider.setValue(self.thumbnail_size)
         self.thumbnail_slider.valueChanged.connect(
-            self.load_images)  # Connect to load_images
-        self.thumbnail_slider.setTracking(True)  # Update only when released
+            self.on_thumbnail_slider_changed)
+        self.thumbnail_slider.setTracking(True)  # Live preview while dragging
+
+        # High quality thumbnails are only produced once the slider settles
+        self.thumbnail_settle_timer = QTimer(self)
+        self.thumbnail_settle_timer.setSingleShot(True)
+        self.thumbnail_settle_timer.setInterval(150)
+        self.thumbnail_settle_timer.timeout.connect(
+            self.on_thumbnail_size_settled)
         main_layout.addWidget(self.thumbnail_slider)
 
         main_widget = QWidget()
         main_widget.setLayout(main_layout)
         self.setCentralWidget(main_widget)
 
+        # Cache statistics in the status bar, to help tuning the budget
+        self.cache_stats_label = QLabel()
+        self.statusBar().addPermanentWidget(self.cache_stats_label)
+        self.cache_stats_timer = QTimer(self)
+        self.cache_stats_timer.timeout.connect(self.update_cache_stats)
+        self.cache_stats_timer.start(1000)
+        self.update_cache_stats()
+
+        # Recent timing spans and counters over the window, toggled with F12
+        self.perf_overlay = PerfOverlay(self)
+        QShortcut(QKeySequence(Qt.Key_F12), self, self.perf_overlay.toggle)
+
+        # Logs the stack of slots that block the event loop, when enabled
+        self.stall_watchdog = None
+        if settings.WATCHDOG_MS > 0:
+            self.stall_watchdog = StallWatchdog(settings.WATCHDOG_MS, self)
+            self.stall_watchdog.start()
+
         self.setGeometry(100, 100, 800, 600)
         self.setWindowTitle("Anzhc's Dataset Tagger")
         self.show()
 
-        self.positive_tags_buttons = []
-        self.negative_tags_buttons = []
+    def update_cache_stats(self):
+        self.cache_stats_label.setText(str(self.pixmap_cache))
 
     def create_tag_selector(self):
         # Create the sub-menu tabs widget
@@ -105,29 +213,37 @@ class ImageBrowser(QMainWindow):
         tag_cloud_widget = QWidget()
         tag_cloud_layout = QVBoxLayout()
 
+        # Boolean query, applied on top of the selected tags
+        self.query_edit = QLineEdit()
+        self.query_edit.setPlaceholderText(
+            "Query, e.g. long hair AND NOT (hat OR *_hat) AND tags>20")
+        self.query_edit.setClearButtonEnabled(True)
+        tag_cloud_layout.addWidget(self.query_edit)
+
+        # The query is applied once typing pauses, or on Enter
+        self.query_timer = QTimer(self)
+        self.query_timer.setSingleShot(True)
+        self.query_timer.setInterval(300)
+        self.query_timer.timeout.connect(self.apply_gallery_query)
+        self.query_edit.textChanged.connect(self.query_timer.start)
+        self.query_edit.returnPressed.connect(self.apply_gallery_query)
+
         # Splitter for Positive and Negative Tags
         tag_splitter = QSplitter(Qt.Vertical)
 
         # Positive Tags
         positive_tags_group = QGroupBox("Positive Tags")
         positive_tags_group_layout = QVBoxLayout()
-        self.positive_tags_layout = FlowLayout(
-        )  # Create FlowLayout for positive tags
 
         # Add QLineEdit for positive tags filter
         self.positive_tag_filter_edit = QLineEdit()
         self.positive_tag_filter_edit.setPlaceholderText("Filter tags...")
-        self.positive_tag_filter_edit.textChanged.connect(
-            self.populate_tag_clouds)
         positive_tags_group_layout.addWidget(self.positive_tag_filter_edit)
 
-        # Add FlowLayout to the group layout
-        positive_tags_container = QWidget()
-        positive_tags_container.setLayout(self.positive_tags_layout)
-        positive_tags_scroll = QScrollArea()
-        positive_tags_scroll.setWidget(positive_tags_container)
-        positive_tags_scroll.setWidgetResizable(True)
-        positive_tags_group_layout.addWidget(positive_tags_scroll)
+        # Add the tag cloud to the group layout
+        self.positive_tag_cloud = TagCloudView(self.positive_tag_model,
+                                               self.tag_search)
+        positive_tags_group_layout.addWidget(self.positive_tag_cloud)
 
         positive_tags_group.setLayout(positive_tags_group_layout)
         tag_splitter.addWidget(positive_tags_group)
@@ -135,14 +251,10 @@ class ImageBrowser(QMainWindow):
         # Negative Tags
         negative_tags_group = QGroupBox("Negative Tags")
         negative_tags_group_layout = QVBoxLayout()
-        self.negative_tags_layout = FlowLayout(
-        )  # Create FlowLayout for negative tags
 
         # Add QLineEdit for negative tags filter
         self.negative_tag_filter_edit = QLineEdit()
         self.negative_tag_filter_edit.setPlaceholderText("Filter tags...")
-        self.negative_tag_filter_edit.textChanged.connect(
-            self.populate_tag_clouds)
         negative_tags_group_layout.addWidget(self.negative_tag_filter_edit)
 
         self.positive_tag_filter_edit.textChanged.connect(
@@ -150,13 +262,10 @@ class ImageBrowser(QMainWindow):
         self.negative_tag_filter_edit.textChanged.connect(
             self.update_negative_tag_cloud_visibility)
 
-        # Add FlowLayout to the group layout
-        negative_tags_container = QWidget()
-        negative_tags_container.setLayout(self.negative_tags_layout)
-        negative_tags_scroll = QScrollArea()
-        negative_tags_scroll.setWidget(negative_tags_container)
-        negative_tags_scroll.setWidgetResizable(True)
-        negative_tags_group_layout.addWidget(negative_tags_scroll)
+        # Add the tag cloud to the group layout
+        self.negative_tag_cloud = TagCloudView(self.negative_tag_model,
+                                               self.tag_search)
+        negative_tags_group_layout.addWidget(self.negative_tag_cloud)
 
         negative_tags_group.setLayout(negative_tags_group_layout)
         tag_splitter.addWidget(negative_tags_group)
@@ -200,16 +309,8 @@ class ImageBrowser(QMainWindow):
         # Create Tag Cloud for Edit
         tag_cloud_widget = QWidget()
         tag_cloud_layout = QVBoxLayout()
-        tags_group = QGroupBox("Tags")
-        self.tags_edit_layout = FlowLayout()
-
-        tags_group.setLayout(self.tags_edit_layout)
-        tags_scroll = QScrollArea()
-        tags_container = QWidget()
-        tags_container.setLayout(self.tags_edit_layout)
-        tags_scroll.setWidget(tags_container)
-        tags_scroll.setWidgetResizable(True)
-        tag_cloud_layout.addWidget(tags_scroll)
+        self.edit_tag_cloud = TagCloudView(self.edit_tag_model)
+        tag_cloud_layout.addWidget(self.edit_tag_cloud)
         tag_cloud_widget.setLayout(tag_cloud_layout)
 
         # Right side vertical layout for existing tag editing features
@@ -270,13 +371,6 @@ class ImageBrowser(QMainWindow):
         self.edit_tags_text_edit.textChanged.connect(
             self.update_tag_button_states)
 
-        for button in self.tag_buttons_dict.values():
-            self.tags_edit_layout.addWidget(button['edit'])
-            button['edit'].setVisible(True)
-        print(
-            f"Added {len(self.tag_buttons_dict)} buttons to the tags edit layout."
-        )
-
         return tag_editing_tab
 
     def create_tag_removal_tab(self):
@@ -293,16 +387,9 @@ class ImageBrowser(QMainWindow):
         # Tag Cloud for Removal Selection
         tag_cloud_widget = QWidget()
         tag_cloud_layout = QVBoxLayout()
-        tags_group = QGroupBox("Tags to Remove")
-        self.tags_removal_layout = FlowLayout()
-
-        tags_group.setLayout(self.tags_removal_layout)
-        tags_scroll = QScrollArea()
-        tags_container = QWidget()
-        tags_container.setLayout(self.tags_removal_layout)
-        tags_scroll.setWidget(tags_container)
-        tags_scroll.setWidgetResizable(True)
-        tag_cloud_layout.addWidget(tags_scroll)
+        self.removal_tag_cloud = TagCloudView(self.removal_tag_model,
+                                              self.tag_search)
+        tag_cloud_layout.addWidget(self.removal_tag_cloud)
         tag_cloud_widget.setLayout(tag_cloud_layout)
         layout.addWidget(tag_cloud_widget)
 
@@ -341,78 +428,129 @@ class ImageBrowser(QMainWindow):
         return mass_edit_tab
 
     def select_folder(self):
+        folder_path = QFileDialog.getExistingDirectory(self, "Select Folder")
+        if not folder_path:
+            return  # Dialog cancelled, the current folder stays open
+        self.caption_writer.wait()  # Finish saving the current folder first
+        self.save_snapshot()
         self.clear_tags()  # Clear the tag data
-        self.folder_path = QFileDialog.getExistingDirectory(
-            self, "Select Folder")
-        self.original_pixmaps = {}  # Clear existing original images
-        self.load_images()
-        self.load_tags()
+        self.folder_path = folder_path
+        self.thumbnail_loader.cancel()
+        self.pixmap_cache.clear()  # Clear existing thumbnails
+        # One directory listing feeds both the gallery and the tag loader
+        with perf.span("scan"):
+            self.dataset = self.scanner.scan(self.folder_path)
+        self.statusBar().showMessage(self.dataset.summary())
+        with perf.span("load_images"):
+            self.load_images()
+        with perf.span("load_tags"):
+            self.load_tags()
         self.initialize_all_tag_buttons()
         self.populate_tag_clouds()
 
     def load_images(self):
         self.thumbnail_size = self.thumbnail_slider.value()
-        if not self.folder_path:
+        if self.dataset is None:
+            self.clear_gallery()
             return
-        # Clear existing widgets
-        for i in reversed(range(self.images_layout.count())):
-            widget = self.images_layout.itemAt(i).widget()
-            if widget is not None:
-                widget.deleteLater()
-
-        self.image_frames.clear()  # Clear existing frames
-
-        # Load images and reapply selection state
-        image_files = [
-            f for f in os.listdir(self.folder_path)
-            if os.path.isfile(os.path.join(self.folder_path, f))
-            and f.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif'))
-        ]
+        # Drop thumbnails still being decoded for the previous size or folder
+        self.thumbnail_loader.cancel()
+        self.gallery_view.set_thumbnail_size(self.thumbnail_size)
 
+        image_files = self.dataset.image_files
         for image_file in image_files:
-            image_path = os.path.join(self.folder_path, image_file)
-
             # Check if the corresponding .txt file exists
-            tag_file_path = os.path.splitext(image_path)[0] + '.txt'
-            if not os.path.exists(tag_file_path):
+            if (self.dataset.manifest_path is None
+                    and self.dataset.sidecars[image_file] is None):
                 # If the .txt file doesn't exist, create it with no content
-                open(tag_file_path, 'a').close()
+                open(self.dataset.sidecar_path(image_file), 'a').close()
+                self.dataset.add_sidecar(image_file)
+
+        # Tiles are painted on demand and only the visible ones request their
+        # thumbnails, selection state is drawn from self.selected_images.
+        # The reset clears the selection.
+        self.gallery_model.set_images(
+            self.dataset.image_path(image_file) for image_file in image_files)
+        self.image_ids = {
+            image_file: image_id
+            for image_id, image_file in enumerate(image_files)
+        }
+        # A model reset shows every row again, load_tags filters once the
+        # index is built
+        self.visible_images = (1 << len(image_files)) - 1
+
+    def clear_gallery(self):
+        # No rows and no ids, matching the cleared tags
+        self.gallery_model.set_images(())
+        self.image_ids.clear()  # Shared with a SQLite store
+        self.visible_images = 0
+
+    def on_thumbnail_slider_changed(self, value):
+        # Cheap preview: tiles are resized right away and painted from
+        # whatever level is cached, without smoothing or new decodes
+        if mip_level(value) != mip_level(self.thumbnail_size):
+            # Decodes queued for the previous level are no longer needed
+            self.thumbnail_loader.cancel()
+        self.thumbnail_size = value
+        self.gallery_delegate.smooth_scaling = False
+        self.gallery_view.set_thumbnail_size(value)
+        self.thumbnail_settle_timer.start()
+
+    def on_thumbnail_size_settled(self):
+        self.gallery_delegate.smooth_scaling = True
+        self.gallery_view.viewport().update()
+
+    def cached_thumbnail(self, image_path, levels=MIP_LEVELS):
+        # Any cached level of the image, largest first
+        for level in reversed(levels):
+            pixmap = self.pixmap_cache.peek((image_path, level))
+            if pixmap is not None:
+                return pixmap
+        return None
+
+    def thumbnail_for(self, image_path):
+        # Called by the gallery delegate for tiles that are being painted
+        level = mip_level(self.thumbnail_size)
+        if not self.thumbnail_loader.is_pending(image_path, level):
+            pixmap = self.pixmap_cache.get((image_path, level))
+            if pixmap is not None:
+                return pixmap
+            if not self.thumbnail_settle_timer.isActive():
+                # Scale down from a larger level when one is cached
+                source = self.cached_thumbnail(
+                    image_path, [l for l in MIP_LEVELS if l > level])
+                self.thumbnail_loader.request(
+                    image_path, level,
+                    None if source is None else source.toImage())
+        return self.cached_thumbnail(image_path)
+
+    def on_thumbnail_loaded(self, image_path, size, thumbnail):
+        self.pixmap_cache.put((image_path, size), QPixmap.fromImage(thumbnail))
+        self.gallery_model.refresh_image(image_path)
+
+    def is_image_selected(self, row):
+        return self.selected_images.is_row_selected(row)
+
+    def on_gallery_pressed(self, index):
+        modifiers = QApplication.keyboardModifiers()
+        row = index.row()
+        if modifiers & Qt.ShiftModifier and self.selection_anchor is not None:
+            # Shift-click selects the visible rows from the anchor on
+            self.selected_images.select_rows(
+                row_range(self.selection_anchor, row) & self.visible_images)
+            self.gallery_view.viewport().update()
+            return
+        self.selection_anchor = row
+        # Ctrl-click toggles the image even in single selection mode
+        self.select_image(index.data(ImagePathRole),
+                          extend=bool(modifiers & Qt.ControlModifier))
 
-        max_columns = self.scroll_area.viewport().width() // (
-            self.thumbnail_size + 20)  # Number of columns
-        row, col = 0, 0
-        for image_file in image_files:
-            image_path = os.path.join(self.folder_path, image_file)
-            if image_path not in self.original_pixmaps:  # Load original image if not already loaded
-                self.original_pixmaps[image_path] = QPixmap(image_path)
-            pixmap = self.original_pixmaps[image_path].scaled(
-                self.thumbnail_size, self.thumbnail_size, Qt.KeepAspectRatio)
-            label = QLabel()
-            label.setPixmap(pixmap)
-            frame = QFrame()
-            frame.setFrameShape(QFrame.Box)
-            frame.setLineWidth(2)
-            frame.setFixedSize(self.thumbnail_size + 10,
-                               self.thumbnail_size + 10)
-            layout = QVBoxLayout()
-            layout.addWidget(label, alignment=Qt.AlignCenter)
-            frame.setLayout(layout)
-            frame.setObjectName(image_path)
-            frame.mousePressEvent = lambda e, path=image_path: self.select_image(
-                path)
-            self.images_layout.addWidget(frame, row, col)
-            col += 1
-            if col >= max_columns:
-                col = 0
-                row += 1
-            self.image_frames[image_path] = frame  # Store the frame
-
-            # Reapply selection state
-            if image_path in self.selected_images:
-                frame.setStyleSheet("border: 6px solid grey;")
-        self.filter_gallery()
+    def visible_image_paths(self):
+        # Images that pass the tag filter, in gallery order
+        image_paths = self.gallery_model.image_paths
+        return [image_paths[row] for row in iter_ids(self.visible_images)]
 
-    def select_image(self, image_path):
+    def select_image(self, image_path, extend=False):
         image_key = os.path.basename(image_path)
         if self.auto_save_checkbox.isChecked() and self.current_image_path:
             # Get the edited tags from the input field
@@ -430,85 +568,186 @@ class ImageBrowser(QMainWindow):
 
         # Update the current image and its corresponding tags
         self.current_image = image_path
-        self.current_tags = self.image_tags[
-            image_key]  # Fetch tags directly from self.image_tags
-        if self.single_selection_mode and len(self.selected_images) > 0:
+        self.current_tags = self.image_tags.get(
+            image_key, set())  # Fetch tags directly from self.image_tags
+        if self.single_selection_mode and not extend and self.selected_images:
             # Deselect all other images
-            for other_image_path in list(self.selected_images):
-                if other_image_path != image_path:
-                    self.deselect_image(other_image_path)
+            self.selected_images.keep_only(
+                self.gallery_model.row_of(image_path))
+            self.gallery_view.viewport().update()
         # Check if the auto copy tags checkbox is checked
         if self.auto_copy_tags_checkbox.isChecked():
             # Copy the existing tags to the input field
             existing_tags_string = ', '.join(self.current_tags)
             self.edit_tags_text_edit.setText(existing_tags_string)
-        frame = self.findChild(QFrame, image_path)
         if image_path in self.selected_images:
-            frame.setStyleSheet("")
             self.selected_images.remove(image_path)
         else:
-            frame.setStyleSheet("border: 6px solid grey;")
             self.selected_images.add(image_path)
-        print(f"Selecting image: {image_path}")
+        self.gallery_model.refresh_image(image_path)
+        log.debug("Selected %s with %d tags", image_path,
+                  len(self.current_tags))
         tags_string = ', '.join(self.current_tags)
         self.current_tags_text_edit.setText(tags_string)
-        print(
-            f"Text set to widget: {self.current_tags_text_edit.toPlainText()}")
 
     def load_tags(self):
-        if not self.folder_path:
+        if self.dataset is None:
             return
 
-        for image_file in os.listdir(self.folder_path):
-            if image_file.lower().endswith(
-                ('.png', '.jpg', '.jpeg', '.bmp', '.gif')):
-                tag_file_path = os.path.join(
-                    self.folder_path,
-                    os.path.splitext(image_file)[0] + ".txt")
-                if os.path.exists(tag_file_path):
-                    with open(tag_file_path, "r") as file:
-                        tag_line = file.read().strip()
-                        tags = [tag.strip() for tag in tag_line.split(',')
-                                ]  # Strip whitespace from each tag
-                        self.image_tags[image_file] = set(
-                            tags)  # Store as a set to remove duplicates
+        self.select_tag_store(len(self.dataset.image_files))
 
-    def populate_tag_clouds(self):
-        # Get the filters
-        positive_filter = self.positive_tag_filter_edit.text()
-        negative_filter = self.negative_tag_filter_edit.text()
-        removal_filter = self.tag_removal_filter_edit.text()
+        if self.dataset.manifest_path is not None:
+            self.load_manifest_tags()
+            return
 
-        # Show/Hide buttons based on filters
+        # Captions unchanged since the folder was last opened come from its
+        # snapshot; only the others are read
+        snapshot = None
+        dataset_index = self.snapshot_index()
+        if dataset_index is not None:
+            snapshot = dataset_index.load(self.folder_path)
+        if snapshot is not None:
+            # The snapshot rows hold ids of its vocabulary
+            self.image_tags.vocabulary.load(snapshot.tags)
+        stamps = DatasetSnapshot(self.folder_path)
+        loaded_tags = {}
+        items = []
+        for image_file in self.dataset.image_files:
+            tag_file_path = self.dataset.sidecars[image_file]
+            if tag_file_path is None:
+                continue
+            try:
+                stat = self.dataset.stat(os.path.basename(tag_file_path))
+            except OSError:
+                items.append((image_file, tag_file_path))
+                continue
+            stamps.set_stamp(image_file, stat)
+            row = snapshot.row(image_file, stat) if snapshot else None
+            if row is None:
+                items.append((image_file, tag_file_path))
+            else:
+                loaded_tags[image_file] = row
+
+        if items:
+            # Caption files are read on a thread pool; the modal progress
+            # dialog keeps the window painting and lets the user cancel
+            progress_dialog = QProgressDialog("Loading captions...", "Cancel",
+                                              0, len(items), self)
+            progress_dialog.setWindowModality(Qt.WindowModal)
+            progress_dialog.setMinimumDuration(500)
+
+            def report_progress(done, total):
+                progress_dialog.setValue(done)
+                if progress_dialog.wasCanceled():
+                    self.caption_loader.cancel()
+
+            with perf.span("captions.read", files=len(items)):
+                read_tags = self.caption_loader.load(items, report_progress,
+                                                     self.image_tags.encode)
+            progress_dialog.reset()
+            if read_tags is None:
+                # The images whose captions were not read would show up
+                # untagged, and an edit would overwrite their captions, so
+                # the folder is left unopened: no rows, no tags
+                self.clear_gallery()
+                self.index_loaded_tags({})
+                self.statusBar().showMessage("Caption loading cancelled")
+                return
+            loaded_tags.update(read_tags)
+            for image_file, _ in items:
+                if image_file not in read_tags:
+                    stamps.invalidate(image_file)  # Retry on the next open
+
+        self.index_loaded_tags(loaded_tags)
+
+        self.dataset_snapshot = stamps
+        if dataset_index is not None and (items or snapshot is None
+                                          or len(snapshot) != len(stamps)):
+            dataset_index.save(stamps, self.image_tags)
+
+    def load_manifest_tags(self):
+        # All captions come from one sequential read, so there is nothing
+        # for a snapshot to save
+        manifest = CaptionManifest(self.dataset.manifest_path)
         try:
-            for tag, buttons in self.tag_buttons_dict.items():
-                # Check if tag contains the filter text
-                show_positive = positive_filter in tag
-                show_negative = negative_filter in tag
-                show_removal = removal_filter in tag
-
-                # Update button visibility for positive, negative, and removal buttons
-                if "positive" in buttons:
-                    buttons["positive"].setVisible(show_positive)
-                    buttons["positive"].setChecked(
-                        tag in self.selected_positive_tags)
-                else:
-                    print(f"Missing positive button for tag: {tag}")
+            with perf.span("captions.read_manifest"):
+                loaded_tags = manifest.load(self.image_tags.encode)
+        except Exception as e:  # OSError, bad UTF-8 or zstd data
+            log.error("Error reading %s: %s", manifest.path, e)
+            self.statusBar().showMessage(f"Could not read {manifest.path}")
+            return
+        self.manifest = manifest
+        # Images without a record have no tags yet
+        no_tags = self.image_tags.encode(())
+        for image_file in self.dataset.image_files:
+            loaded_tags.setdefault(image_file, no_tags)
+        self.index_loaded_tags(loaded_tags)
+
+    def index_loaded_tags(self, loaded_tags):
+        # Merge all captions in one batch, in directory order
+        self.image_tags.load_rows((image_file, loaded_tags[image_file])
+                                  for image_file in self.dataset.image_files
+                                  if image_file in loaded_tags)
+        # Index and count the tag ids, the rows are never decoded here
+        with perf.span("tag_index.rebuild", images=len(self.image_ids)):
+            self.tag_index.rebuild(
+                len(self.image_ids),
+                ((self.image_ids[image_file], row)
+                 for image_file, row in self.image_tags.rows()),
+                self.image_tags.vocabulary.tags)
+            self.tag_stats.set_counts(self.image_tags.tag_counts())
+        self.filter_gallery()
 
-                if "negative" in buttons:
-                    buttons["negative"].setVisible(show_negative)
-                    buttons["negative"].setChecked(
-                        tag in self.selected_negative_tags)
-                else:
-                    print(f"Missing negative button for tag: {tag}")
+    def snapshot_index(self):
+        # The SQLite store keeps the rows out of memory, a snapshot would
+        # read all of them back, one query per image. Datasets that large
+        # read their captions on every open instead.
+        if isinstance(self.image_tags, SqliteTagTable):
+            return None
+        return self.dataset_index
+
+    def select_tag_store(self, image_count):
+        # Very large datasets keep their tags in SQLite rather than in memory
+        use_sqlite = (settings.SQLITE_MIN_IMAGES > 0
+                      and image_count >= settings.SQLITE_MIN_IMAGES)
+        if use_sqlite != isinstance(self.image_tags, SqliteTagTable):
+            self.image_tags.close()
+            if use_sqlite:
+                self.image_tags = SqliteTagTable.create(
+                    os.path.join(settings.CACHE_DIR, "tagstore"))
+                self.tag_index = SqliteTagIndex(self.image_tags)
+            else:
+                self.image_tags = TagTable()
+                self.tag_index = TagIndex()
+        if use_sqlite:
+            # Rows are stored under their gallery row
+            self.image_tags.image_ids = self.image_ids
+            # The database only lives as long as the session, the captions
+            # are still what saving writes and opening reads
+            self.statusBar().showMessage(
+                self.statusBar().currentMessage() +
+                " - tags kept in a per-session SQLite working store")
+
+    def closeEvent(self, event):
+        # Let a running save complete before the store goes away
+        self.caption_writer.wait()
+        self.save_snapshot()
+        self.image_tags.close()
+        if self.stall_watchdog is not None:
+            self.stall_watchdog.stop()
+        perf.log_counters()
+        super().closeEvent(event)
 
-                if "removal" in buttons:
-                    buttons["removal"].setVisible(show_removal)
-                else:
-                    print(f"Missing removal button for tag: {tag}")
-        except Exception as e:
-            print("Exception occurred:", e)
-            print(traceback.format_exc())
+    def populate_tag_clouds(self):
+        # Apply the filters and the selected tags to the clouds
+        self.positive_tag_cloud.set_filter(
+            self.positive_tag_filter_edit.text())
+        self.negative_tag_cloud.set_filter(
+            self.negative_tag_filter_edit.text())
+        self.removal_tag_cloud.set_filter(self.tag_removal_filter_edit.text())
+        self.positive_tag_model.set_checked_tags(self.selected_positive_tags)
+        self.negative_tag_model.set_checked_tags(self.selected_negative_tags)
+        self.removal_tag_model.set_checked_tags(self.selected_tags_for_removal)
 
     def toggle_tag(self, tag, state, negative=False):
         if state:
@@ -527,106 +766,132 @@ class ImageBrowser(QMainWindow):
         )  # Call to filter the gallery based on selected tags
         self.update_selected_tags_display()
 
-    def should_show_image(self, image_path):
-        image_tags = self.image_tags.get(os.path.basename(image_path), set())
-
-        # If any positive tags are selected, the image must have at least one of them
-        if self.selected_positive_tags and not any(
-                tag in image_tags for tag in self.selected_positive_tags):
-            return False
-
-        # If any negative tags are selected, the image must not have any of them
-        if self.selected_negative_tags and any(
-                tag in image_tags for tag in self.selected_negative_tags):
-            return False
-
-        return True
-
     def filter_gallery(self):
-        row, col = 0, 0
-        max_columns = self.scroll_area.viewport().width() // (
-            self.thumbnail_size + 20)  # Number of columns
-
-        for image_path, frame in self.image_frames.items():
-            # Determine if the image should be shown based on the tags
-            should_show = self.should_show_image(image_path)
-
-            if should_show:
-                # If the image should be shown, position it at the current row and column
-                self.images_layout.addWidget(frame, row, col)
-                col += 1
-                if col >= max_columns:
-                    col = 0
-                    row += 1
-
-            # Show or hide the frame
-            frame.setVisible(should_show)
+        # Images with any positive tag and no negative tag, from the index
+        with perf.span("filter"):
+            visible = self.tag_index.filter(self.selected_positive_tags,
+                                            self.selected_negative_tags)
+            if self.gallery_query is not None:
+                visible &= self.gallery_query.evaluate(self.tag_index,
+                                                       self.tag_search)
+
+            # Only touch the rows whose visibility actually changed
+            changed = visible ^ self.visible_images
+            for row in iter_ids(changed):
+                self.gallery_view.setRowHidden(row, not (visible >> row) & 1)
+            self.visible_images = visible
+        perf.count("gallery.rows_toggled", changed.bit_count())
+
+    def apply_gallery_query(self):
+        self.query_timer.stop()
+        text = self.query_edit.text()
+        try:
+            query = TagQuery(text) if text.strip() else None
+        except QueryError as e:
+            # Leave the gallery as it is until the query parses
+            self.statusBar().showMessage(f"Query: {e}")
+            return
+        self.statusBar().clearMessage()
+        self.gallery_query = query
+        self.filter_gallery()
 
     def clear_tag_selection(self):
         # Clear selected positive tags
-        for button in self.positive_tags_buttons:
-            button.setChecked(False)
+        self.positive_tag_model.set_checked_tags(())
         self.selected_positive_tags.clear()
 
         # Clear selected negative tags
-        for button in self.negative_tags_buttons:
-            button.setChecked(False)
+        self.negative_tag_model.set_checked_tags(())
         self.selected_negative_tags.clear()
 
         # Refresh the gallery
         self.filter_gallery()
 
     def select_all_visible_images(self):
-        for image_path, frame in self.image_frames.items():
-            if frame.isVisible():
-                frame.setStyleSheet("border: 6px solid grey;")
-                self.selected_images.add(image_path)
+        self.selected_images.select_rows(self.visible_images)
+        self.gallery_view.viewport().update()
 
     def deselect_visible_images(self):
-        for image_path, frame in self.image_frames.items():
-            if frame.isVisible():
-                frame.setStyleSheet("")
-                self.selected_images.discard(image_path)
+        self.selected_images.deselect_rows(self.visible_images)
+        self.gallery_view.viewport().update()
 
     def deselect_image(self, image_path):
         # Remove the image path from the set of selected images
         if image_path in self.selected_images:
             self.selected_images.remove(image_path)
 
-        # Update the border of the corresponding frame in the main gallery
-        frame = self.image_frames.get(image_path)
-        if frame:
-            frame.setStyleSheet("")  # Resetting the border style
+        # Repaint the tile without its selection border
+        self.gallery_model.refresh_image(image_path)
 
     def copy_existing_tags(self):
         # Copy the content from the current tags text edit to the editable text edit
         self.edit_tags_text_edit.setPlainText(
             self.current_tags_text_edit.toPlainText())
 
-    def update_tags(self, image_path, new_tags_set):
-        # Use the base filename as the key
-        image_file = os.path.basename(image_path)
-
-        # Update the in-memory tag data for the specified image
+    def tag_transaction(self):
+        # Batch tag edits; see TagEditTransaction
+        return TagEditTransaction(self.commit_tag_changes)
+
+    def commit_tag_changes(self, changes):
+        # Apply {image_file: new tag set} in one pass, then update the tag
+        # clouds once for every tag whose count changed
+        changed_tags = set()
+        with perf.span("tag_edit.apply", images=len(changes)):
+            for image_file, new_tags_set in changes.items():
+                old_tags = self.image_tags.get(image_file, set())
+                if old_tags == new_tags_set:
+                    continue
+                self.set_image_tags(image_file, new_tags_set, old_tags)
+                self.edited_tags.add(image_file)
+                changed_tags.update(old_tags ^ new_tags_set)
+            self.image_tags.maybe_compact()
+        self.update_tag_cloud(changed_tags)
+
+    def mass_edit_store(self, image_ids, added_tags, removed_tags):
+        # Adds and removes tags on the images of the image_ids bitmap of an
+        # SQLite store in set-based statements, instead of reading and
+        # rewriting the row of every image. The index postings tell which
+        # images change and by how much each count moves.
+        deltas = {}
+        changed_ids = 0
+        for tag in added_tags:
+            gained = image_ids & ~self.tag_index.posting(tag)
+            if gained:
+                deltas[tag] = gained.bit_count()
+                changed_ids |= gained
+        for tag in removed_tags:
+            lost = image_ids & self.tag_index.posting(tag)
+            if lost:
+                deltas[tag] = -lost.bit_count()
+                changed_ids |= lost
+        if not changed_ids:
+            return
+        image_files = self.dataset.image_files
+        changed_files = [
+            image_files[image_id] for image_id in iter_ids(changed_ids)
+        ]
+        with perf.span("tag_edit.apply", images=len(changed_files)):
+            encode = self.image_tags.encode
+            self.image_tags.edit_tags(
+                changed_files,
+                encode([tag for tag in deltas if deltas[tag] > 0]),
+                encode([tag for tag in deltas if deltas[tag] < 0]))
+            self.image_tags.maybe_compact()
+            self.tag_index.update_tags(deltas)
+            self.tag_stats.apply_counts(deltas)
+            self.edited_tags.update(changed_files)
+        self.update_tag_cloud(set(deltas))
+
+    def set_image_tags(self, image_file, new_tags_set, old_tags=None):
+        # Every change to image_tags goes through here to keep the index and
+        # the tag counts in sync
+        if old_tags is None:
+            old_tags = self.image_tags.get(image_file, set())
         self.image_tags[image_file] = new_tags_set
-
-        # Recount all the tags
-        all_tags = {}
-        for tags in self.image_tags.values():
-            for tag in tags:
-                all_tags[tag] = all_tags.get(tag, 0) + 1
-
-        # Convert the set to a comma-separated string
-        new_tags_string = ', '.join(new_tags_set)
-
-        # Set the text of the current tags text edit
-        self.current_tags_text_edit.setText(new_tags_string)
-
-        # Refresh the tag editing tab to reflect the changes
-        #self.refresh_tag_editing_tab()
-
-        # Refresh the tag clouds to reflect the changes
-        self.refresh_all_tag_clouds()
+        self.tag_stats.apply_delta(old_tags, new_tags_set)
+        image_id = self.image_ids.get(image_file)
+        if image_id is not None:
+            self.tag_index.update_image(image_id, old_tags, new_tags_set)
 
     def revert_to_original_tags(self):
         # Check if only one image is selected
@@ -645,8 +910,8 @@ class ImageBrowser(QMainWindow):
         # Update the editable tags text edit to match the original
         self.edit_tags_text_edit.setPlainText(original_tags)
 
-        # Remove the edited tags from the edited_tags dictionary
-        self.edited_tags.pop(image_path, None)
+        # Remove the image from the edited images
+        self.edited_tags.discard(image_path)
 
     def load_selected_image_tags(self):
         # Clear any existing content
@@ -667,24 +932,102 @@ class ImageBrowser(QMainWindow):
                     self.current_tags_text_edit.setPlainText(tags)
 
     def save_all_tags(self):
-        for image_path, new_tags in self.edited_tags.items():
-            image_file_name = os.path.basename(image_path)
-            tag_file_name = os.path.splitext(image_file_name)[0] + '.txt'
-            tag_file_path = os.path.join(self.folder_path, tag_file_name)
-
-            # Convert the set of tags to a string
-            new_tags_string = ', '.join(new_tags)
-
-            try:
-                with open(tag_file_path, 'w') as file:
-                    file.write(new_tags_string)
-            except Exception as e:
-                print(f"Error saving tags for {image_file_name}: {e}")
-
-        # Clear the edited_tags dictionary since changes have been saved
+        # The captions are rendered here and written atomically on the
+        # writer thread, so editing can go on while they are saved
+        if not self.edited_tags or self.dataset is None:
+            return
+        if self.dataset.manifest_path is not None:
+            self.save_manifest_tags()
+            return
+        jobs = []
+        with perf.span("save.render", captions=len(self.edited_tags)):
+            for image_path in self.edited_tags:
+                image_file_name = os.path.basename(image_path)
+                new_tags = self.image_tags.get(image_file_name, set())
+                tag_file_name = os.path.splitext(image_file_name)[0] + '.txt'
+                tag_file_path = os.path.join(self.folder_path, tag_file_name)
+
+                # Convert the set of tags to a string
+                new_tags_string = ', '.join(new_tags)
+                jobs.append((image_file_name, tag_file_path, new_tags_string))
+
+        perf.count("captions.queued", len(jobs))
+        # Edits made from now on belong to the next save
+        self.saving_tags.update(image_file for image_file, _, _ in jobs)
+        self.edited_tags.clear()
+        self.caption_writer.write(jobs, self.dataset)
+
+    def save_manifest_tags(self):
+        # The records of the edited images are appended to the manifest in
+        # one write on the writer thread
+        if self.manifest is None:
+            self.statusBar().showMessage(
+                "Not saved, the caption manifest could not be read")
+            return
+        jobs = [(image_file, self.manifest.path,
+                 sorted(self.image_tags.get(image_file, set())))
+                for image_file in self.edited_tags]
+        perf.count("captions.queued", len(jobs))
+        self.saving_tags.update(image_file for image_file, _, _ in jobs)
         self.edited_tags.clear()
+        self.caption_writer.write(jobs,
+                                  self.dataset,
+                                  write_batch=self.manifest.append,
+                                  batch_size=len(jobs))
+
+    def finish_saving(self, image_file):
+        self.saving_tags[image_file] -= 1
+        if self.saving_tags[image_file] <= 0:
+            del self.saving_tags[image_file]
+
+    def on_captions_saved(self, dataset, written):
+        if dataset is not self.dataset:
+            return  # Saved for a folder that has been closed since
+        for image_file, stat in written:
+            self.finish_saving(image_file)
+            if self.dataset_snapshot is not None:
+                self.dataset_snapshot.set_stamp(image_file, stat)
+
+    def on_caption_save_failed(self, dataset, image_file, error):
+        log.error("Error saving tags for %s: %s", image_file, error)
+        if dataset is not self.dataset:
+            return
+        # Still unsaved, the next save tries again
+        self.finish_saving(image_file)
+        self.edited_tags.add(image_file)
+        if self.dataset_snapshot is not None:
+            self.dataset_snapshot.invalidate(image_file)
+
+    def on_save_progress(self, done, total):
+        self.statusBar().showMessage(f"Saving captions: {done}/{total}")
+
+    def on_save_finished(self, dataset, written, failed):
+        message = f"Saved {written} captions"
+        if failed:
+            message += f", {failed} failed (see the log)"
+        self.statusBar().showMessage(message)
+        if dataset is self.dataset and written:
+            # Encoding the snapshot costs as much as the whole dataset, so
+            # it is written once, when the folder is closed
+            self.snapshot_stale = True
+
+    def save_snapshot(self):
+        snapshot = self.dataset_snapshot
+        dataset_index = self.snapshot_index()
+        if not self.snapshot_stale or dataset_index is None or snapshot is None:
+            return
+        self.snapshot_stale = False
+        # Rows changed since their caption was last written do not match
+        # the file, they are read again on the next open
+        for image_file in self.edited_tags | set(self.saving_tags):
+            snapshot.invalidate(image_file)
+        dataset_index.save(snapshot, self.image_tags)
 
     def load_original_tags(self, image_path):
+        if self.manifest is not None:
+            # Reads the whole manifest, fine for a button press
+            tags = self.manifest.record(os.path.basename(image_path))
+            return ', '.join(tags or ())
         tag_file_path = os.path.splitext(image_path)[0] + ".txt"
         with open(tag_file_path, 'r', encoding='utf-8') as file:
             original_tags = file.read()
@@ -695,11 +1038,13 @@ class ImageBrowser(QMainWindow):
         image_key = os.path.basename(image_path)
 
         # Check if updated tags are available for the image
-        if image_key in self.edited_tags:
-            print(
-                f"Retrieved tags for {image_key} from edited_tags: {self.edited_tags[image_key]}"
-            )  # Add this line
-            return self.edited_tags[image_key]
+        if image_key in self.edited_tags or image_key in self.saving_tags:
+            tags = self.image_tags[image_key]
+            log.debug("Tags of %s come from the unsaved edits", image_key)
+            return tags
+        if self.manifest is not None:
+            # Unedited tags are the saved ones
+            return self.image_tags.get(image_key, set())
 
         tag_file_path_base = os.path.splitext(image_key)[
             0]  # Remove the extension
@@ -732,48 +1077,13 @@ class ImageBrowser(QMainWindow):
 
         self.edit_tags_text_edit.setPlainText(updated_tags)
 
-    def refresh_tag_editing_tab(self):
-        # 1. Extract all unique tags from self.image_tags
-        all_tags = set()
-        for tags in self.image_tags.values():
-            all_tags.update(tags)
-
-        # 2. Sort the tags (optional, but can be useful for display)
-        sorted_tags = sorted(all_tags)
-
-        # 3. Populate the tag cloud in the editing tab
-        # Clear existing buttons from the layout
-        for i in reversed(range(self.tags_edit_layout.count())):
-            widget = self.tags_edit_layout.itemAt(i).widget()
-            if widget is not None:
-                try:
-                    widget.clicked.disconnect()  # Try to disconnect signals
-                except TypeError:
-                    pass  # Ignore the error if no connections to disconnect
-
-                widget.deleteLater()
-
-        # Add the buttons for each tag to the layout
-        for tag in sorted_tags:
-            tag_button = QPushButton(tag)
-            tag_button.setCheckable(True)  # Allow the button to be checked
-            tag_button.clicked.connect(
-                lambda _, tag=tag: self.add_tag_to_edit(tag))
-            self.tags_edit_layout.addWidget(tag_button)
-
-        # Update the state of the tag buttons to match the current tags
-        self.update_tag_button_states()
-
     def update_tag_button_states(self):
         # Get the current tags in the text field
         current_tags = set(
             self.edit_tags_text_edit.toPlainText().strip().split(', '))
 
-        # Update the state of each tag button
-        for i in range(self.tags_edit_layout.count()):
-            widget = self.tags_edit_layout.itemAt(i).widget()
-            if widget is not None:
-                widget.setChecked(widget.text() in current_tags)
+        # Check the tags of the edit cloud that are in the text field
+        self.edit_tag_model.set_checked_tags(current_tags)
 
     def toggle_tag_for_removal(self, tag, state):
         if state:
@@ -782,35 +1092,28 @@ class ImageBrowser(QMainWindow):
             self.selected_tags_for_removal.discard(tag)
 
     def remove_selected_tags_from_dataset(self):
-        print(f"remove_selected_tags_from_dataset called at {datetime.now()}")
-        if not self.selected_tags_for_removal:
+        log.debug("Removing tags from the dataset: %s",
+                  self.selected_tags_for_removal)
+        if not self.selected_tags_for_removal or self.dataset is None:
             return
 
-        # Create a set to track removed tags
-        removed_tags = set()
-
-        # Iterate through the image tags in memory and remove the selected tags
-        for image_file, tags in self.image_tags.items():
-            # Get the original tags
-            original_tags = tags.copy()
-
-            # Update the tags in-memory
-            tags.difference_update(self.selected_tags_for_removal)
-
-            # Update the edited_tags dictionary using image_key
-            image_key = os.path.splitext(image_file)[0]
-            self.edited_tags[image_key] = tags
-
-            # Track the removed tags
-            removed_tags.update(original_tags - tags)
-
-        # Refresh the tag clouds to reflect the changes
-        self.refresh_all_tag_clouds()
+        # Only the images that carry one of the tags need to change
+        removal_tags = self.selected_tags_for_removal
+        image_files = self.dataset.image_files
+        affected_ids = self.tag_index.union(removal_tags)
+        if isinstance(self.image_tags, SqliteTagTable):
+            self.mass_edit_store(affected_ids, set(), removal_tags)
+            return
+        with self.tag_transaction() as transaction:
+            for image_id in iter_ids(affected_ids):
+                image_file = image_files[image_id]
+                new_tags = self.image_tags[image_file] - removal_tags
+                transaction.set_tags(image_file, new_tags)
 
     def apply_tag_edit(self, image_path, new_tags):
         # Check if image_path is None or an empty string
         if not image_path:
-            print("No image selected. Cannot apply tag edit.")
+            log.warning("No image selected. Cannot apply tag edit.")
             return
 
         new_tags_list = [
@@ -822,21 +1125,12 @@ class ImageBrowser(QMainWindow):
         existing_tags = self.image_tags.get(image_file, set())
 
         if existing_tags != new_tags_set:
-            self.edited_tags[image_file] = new_tags_set
+            with self.tag_transaction() as transaction:
+                transaction.set_tags(image_file, new_tags_set)
 
             # Update the original tags display
             self.current_tags_text_edit.setText(', '.join(new_tags_set))
 
-            # Update the in-memory tag data
-            self.update_tags(image_path, new_tags_set)
-
-            # Determine which tags were added and which were removed
-            added_tags = new_tags_set - existing_tags
-            removed_tags = existing_tags - new_tags_set
-
-            # Update the tag clouds to reflect the changes
-            self.update_tag_cloud(added_tags, removed_tags)
-
     def update_selected_tags_display(self):
         selected_tags = ', '.join(self.selected_positive_tags)
         self.selected_tags_text_edit.setText(selected_tags)
@@ -850,15 +1144,19 @@ class ImageBrowser(QMainWindow):
             for tag in self.new_tags_text_edit.toPlainText().strip().split(
                 ','))
 
-        # Tracks added and removed tags globally
-        added_tags_global = set()
-        removed_tags_global = set()
+        if isinstance(self.image_tags, SqliteTagTable):
+            # Empty tags are dropped, as apply_tag_edit does
+            self.mass_edit_store(self.visible_images, new_tags - {""},
+                                 selected_tags - new_tags)
+            return
 
-        for image_path, frame in self.image_frames.items():
-            if frame.isVisible():
+        # All visible images are edited in one transaction, so the index,
+        # the counts and the tag clouds are updated once at the end
+        with self.tag_transaction() as transaction:
+            for image_path in self.visible_image_paths():
                 # Get the base name of the image to use as the key
                 image_key = os.path.basename(image_path)
-                existing_tags = self.image_tags.get(image_key, set()).copy()
+                existing_tags = self.image_tags.get(image_key, set())
 
                 # Determine the tags to be removed (only those not in the new tags)
                 removed_tags = selected_tags.intersection(
@@ -866,41 +1164,32 @@ class ImageBrowser(QMainWindow):
                 # Determine the tags to be added (only those not in the existing tags)
                 added_tags = new_tags - existing_tags
 
-                # Update the global tracking
-                added_tags_global.update(added_tags)
-                removed_tags_global.update(removed_tags)
-
-                # Update the tags
-                existing_tags.difference_update(removed_tags)
-                existing_tags.update(added_tags)
-
-                # Convert the set to a comma-separated string for apply_tag_edit
-                new_tags_string = ', '.join(existing_tags)
-
-                # Call apply_tag_edit with the image path and new tags string
-                self.apply_tag_edit(image_path, new_tags_string)
-
-        # Update the tag clouds with the added and removed tags
-        self.update_tag_cloud(added_tags_global, removed_tags_global)
-        self.refresh_all_tag_clouds()
+                # Empty tags are dropped, as apply_tag_edit does
+                transaction.set_tags(
+                    image_key, {
+                        tag
+                        for tag in (existing_tags - removed_tags) | added_tags
+                        if tag
+                    })
 
     def clear_tags(self):
         self.image_tags.clear()
+        self.dataset_snapshot = None
+        self.snapshot_stale = False
+        self.manifest = None
+        self.tag_index.rebuild(0, ())
+        self.tag_stats = TagStatistics()
         self.edited_tags.clear()
+        self.saving_tags.clear()
         self.selected_positive_tags.clear()
         self.selected_negative_tags.clear()
 
-        # Clear existing tag buttons from layouts and dictionary
-        for layout in [
-                self.positive_tags_layout, self.negative_tags_layout,
-                self.tags_removal_layout
-        ]:
-            for i in reversed(range(layout.count())):
-                widget = layout.itemAt(i).widget()
-                if widget is not None:
-                    widget.deleteLater()
-
-        self.tag_buttons_dict.clear()
+        # Empty the tag clouds
+        self.sorted_tags.clear()
+        self.tag_sort_counts.clear()
+        self.tag_search.clear()
+        for model in self.tag_cloud_models():
+            model.set_tags([], self.tag_sort_counts)
 
     def update_positive_tag_filter(self, text):
         self.positive_tag_filter = text
@@ -910,56 +1199,8 @@ class ImageBrowser(QMainWindow):
         self.negative_tag_filter = text
         self.refresh_all_tag_clouds()
 
-    def initialize_single_tag_button(self, tag, count):
-        # Create the buttons
-        positive_tag_button = QPushButton(f"{tag} ({count})")
-        positive_tag_button.setCheckable(True)
-        positive_tag_button.clicked.connect(
-            lambda state, t=tag: self.toggle_tag(t, state))
-
-        negative_tag_button = QPushButton(f"{tag} ({count})")
-        negative_tag_button.setCheckable(True)
-        negative_tag_button.clicked.connect(
-            lambda state, t=tag: self.toggle_tag(t, state, negative=True))
-
-        removal_tag_button = QPushButton(f"{tag} ({count})")
-        removal_tag_button.setCheckable(True)
-        removal_tag_button.clicked.connect(
-            lambda state, t=tag: self.toggle_tag_for_removal(t, state))
-
-        edit_tag_button = QPushButton(tag)
-        edit_tag_button.setCheckable(True)
-        edit_tag_button.clicked.connect(
-            lambda _, t=tag: self.add_tag_to_edit(t))
-
-        # Create the buttons dictionary
-        buttons = {
-            "positive": positive_tag_button,
-            "negative": negative_tag_button,
-            "removal": removal_tag_button,
-            "edit": edit_tag_button
-        }
-
-        return buttons
-
     def initialize_all_tag_buttons(self):
-        # Calculate all_tags based on the current state of image_tags
-        all_tags = self.calculate_tag_counts()
-
-        # Create the buttons and add them to a temporary dictionary
-        temp_buttons_dict = {}
-        for tag, count in all_tags.items():
-            buttons = self.initialize_single_tag_button(tag, count)
-            temp_buttons_dict[tag] = buttons
-
-        # Sort the temporary dictionary by the count of each tag in descending order
-        sorted_tags = sorted(temp_buttons_dict.items(),
-                             key=lambda item: -all_tags.get(item[0], 0))
-
-        # Create a new SortedDict using the sorted tags
-        self.tag_buttons_dict = SortedDict(lambda tag: -all_tags.get(tag, 0))
-        for tag, buttons in sorted_tags:
-            self.tag_buttons_dict[tag] = buttons
+        # Fill the tag clouds with every tag of the dataset
         self.refresh_all_tag_clouds()
 
     def toggle_tag_in_edit(self, tag, state):
@@ -971,181 +1212,59 @@ class ImageBrowser(QMainWindow):
             current_tags = [t for t in current_tags if t != tag]
         self.edit_tags_text_edit.setText(', '.join(current_tags))
 
-    def update_tag_cloud(self, added_tags, removed_tags):
-        # Extract all unique tags from self.image_tags
-        all_tags = self.calculate_tag_counts()
-
-        # Handle the added tags
-        for tag in added_tags:
-            count = all_tags[tag]
-            buttons = self.initialize_single_tag_button(tag, count)
-            self.tag_buttons_dict[tag] = buttons
-            for layout_key, layout in zip(
-                ['positive', 'negative', 'removal', 'edit'], [
-                    self.positive_tags_layout, self.negative_tags_layout,
-                    self.tags_removal_layout, self.tags_edit_layout
-                ]):
-                layout.addWidget(buttons[layout_key])
-
-        # Handle the removed tags
-        for tag in removed_tags:
-            buttons = self.tag_buttons_dict[tag]
-            for button in buttons.values():
-                button.setParent(None)
-                button.deleteLater()
-            del self.tag_buttons_dict[tag]
-
-        # Now we'll rebuild all the layouts according to the sorted order
-        for layout_key, layout in zip(
-            ['positive', 'negative', 'removal', 'edit'], [
-                self.positive_tags_layout, self.negative_tags_layout,
-                self.tags_removal_layout, self.tags_edit_layout
-            ]):
-            # Clear the existing widgets in the layout
-            for _ in range(layout.count()):
-                widget = layout.itemAt(0).widget()
-                layout.removeWidget(widget)
-
-            # Add widgets back according to the sorted order
-            for tag, buttons in self.tag_buttons_dict.items():
-                button = buttons[layout_key]
-                layout.addWidget(button)
+    def tag_cloud_models(self):
+        return (self.positive_tag_model, self.negative_tag_model,
+                self.removal_tag_model, self.edit_tag_model)
 
-    def refresh_all_tag_clouds(self):
-        # Extract all unique tags from self.image_tags
-        all_tags = self.calculate_tag_counts()
-
-        # Create a temporary dictionary to store the new buttons
-        new_tag_buttons_dict = SortedDict(lambda tag: -all_tags.get(tag, 0))
-
-        # Check each tag in the dictionary
-        for tag, buttons in self.tag_buttons_dict.items():
-            if tag not in all_tags:
-                # The tag has been removed
-                # Remove the buttons from the layout and delete them
-                buttons['positive'].setParent(None)
-                buttons['negative'].setParent(None)
-                buttons['removal'].setParent(None)
-                buttons['positive'].deleteLater()
-                buttons['negative'].deleteLater()
-                buttons['removal'].deleteLater()
-            else:
-                # The tag still exists
-                # Update the count in the button text
-                count = all_tags[tag]
-                buttons['positive'].setText(f"{tag} ({count})")
-                buttons['negative'].setText(f"{tag} ({count})")
-                buttons['removal'].setText(f"{tag} ({count})")
-                # Add the existing buttons to the new sorted dictionary
-                new_tag_buttons_dict[tag] = buttons
-
-        # Any tags left in the all_tags dictionary are new tags
-        # Add buttons for the new tags
-        for tag, count in all_tags.items():
-            if tag not in new_tag_buttons_dict and tag in self.tag_buttons_dict:
-                self.initialize_single_tag_button(tag, count)
-                new_tag_buttons_dict[tag] = self.tag_buttons_dict[tag]
-
-        # Assign the new sorted dictionary to the tag_buttons_dict attribute
-        self.tag_buttons_dict = new_tag_buttons_dict
-
-        # Rebuild the layouts according to the sorted order
-        for tag, buttons in self.tag_buttons_dict.items():
-            self.positive_tags_layout.addWidget(buttons['positive'])
-            self.negative_tags_layout.addWidget(buttons['negative'])
-            self.tags_removal_layout.addWidget(buttons['removal'])
-
-    def delete_tag_button(self, button, tag):
-        # Disconnect any signals from the button
-        try:
-            button.clicked.disconnect()
-        except TypeError:
-            pass  # No connections to disconnect
-
-        # Remove the button from the layouts
-        self.positive_tags_layout.removeWidget(button)
-        self.negative_tags_layout.removeWidget(button)
-        self.tags_removal_layout.removeWidget(button)
-        self.tags_edit_layout.removeWidget(button)
+    def update_tag_cloud(self, changed_tags):
+        # Move the changed tags to their new place in the count order, or
+        # out of the clouds once no image carries them
+        if not changed_tags:
+            return
+        with perf.span("tag_clouds.update", tags=len(changed_tags)):
+            all_tags = self.calculate_tag_counts()
+            for tag in changed_tags:
+                # Take the tag out of the sorted list before its key changes
+                if tag in self.tag_sort_counts:
+                    self.sorted_tags.remove(tag)
+                    del self.tag_sort_counts[tag]
+                count = all_tags.get(tag, 0)
+                if count:
+                    self.tag_sort_counts[tag] = count
+                    self.sorted_tags.add(tag)
+                    self.tag_search.add(tag)
+                else:
+                    self.tag_search.discard(tag)
 
-        # Delete the button
-        button.deleteLater()
+            # The clouds share the tag list and counts, lay out again from
+            # the first changed tag and only paint the chips on screen
+            tags = list(self.sorted_tags)
+            for model in self.tag_cloud_models():
+                model.set_tags(tags, self.tag_sort_counts, changed_tags)
 
-        # Remove the button's reference from the dictionary
-        if tag in self.tag_buttons_dict:
-            del self.tag_buttons_dict[tag]
+    def refresh_all_tag_clouds(self):
+        # Resync every known and every counted tag
+        self.update_tag_cloud(
+            set(self.tag_sort_counts) | set(self.calculate_tag_counts()))
 
     def calculate_tag_counts(self, specific_tag=None):
-        all_tags = {}
-        for tags_set in self.image_tags.values():
-            for tag in tags_set:
-                if specific_tag is not None and tag != specific_tag:
-                    continue
-                all_tags[tag] = all_tags.get(tag, 0) + 1
-        return all_tags
+        # Counts are maintained incrementally by self.tag_stats
+        if settings.DEBUG:
+            mismatches = self.tag_stats.verify(self.image_tags.values())
+            if mismatches:
+                log.error("Tag counts out of sync (counted, expected): %s",
+                          mismatches)
+        return self.tag_stats.snapshot(specific_tag)
 
     def update_positive_tag_cloud_visibility(self):
-        filter_text = self.positive_tag_filter_edit.text()
-        for tag, buttons in self.tag_buttons_dict.items():
-            buttons['positive'].setVisible(filter_text in tag)
+        # Applied once typing pauses
+        self.positive_tag_cloud.schedule_filter(
+            self.positive_tag_filter_edit.text())
 
     def update_negative_tag_cloud_visibility(self):
-        filter_text = self.negative_tag_filter_edit.text()
-        for tag, buttons in self.tag_buttons_dict.items():
-            buttons['negative'].setVisible(filter_text in tag)
+        self.negative_tag_cloud.schedule_filter(
+            self.negative_tag_filter_edit.text())
 
     def update_removal_tag_cloud_visibility(self):
-        filter_text = self.tag_removal_filter_edit.text()
-        for tag, buttons in self.tag_buttons_dict.items():
-            buttons['removal'].setVisible(filter_text in tag)
-
-    def update_tag_cloud(self, added_tags, removed_tags):
-        # Extract all unique tags from self.image_tags
-        all_tags = self.calculate_tag_counts()
-
-        # Update the tag cloud for the added tags
-        for tag in added_tags:
-            count = all_tags.get(tag, 0)
-            if count == 0:
-                continue  # Skip if the tag does not exist in all_tags
-            buttons = self.initialize_single_tag_button(tag, count)
-            self.tag_buttons_dict[tag] = buttons
-            self.positive_tags_layout.addWidget(buttons['positive'])
-            self.negative_tags_layout.addWidget(buttons['negative'])
-            self.tags_removal_layout.addWidget(buttons['removal'])
-            # Handle the edit layout here if needed
-
-        # Update the tag cloud for the removed tags
-        for tag in removed_tags:
-            if tag in self.tag_buttons_dict:  # Check if the tag exists in the dictionary
-                buttons = self.tag_buttons_dict[tag]
-                buttons['positive'].setParent(None)
-                buttons['negative'].setParent(None)
-                buttons['removal'].setParent(None)
-                # Handle the edit layout here if needed
-                del self.tag_buttons_dict[tag]
-
-        # Re-arrange the widgets in the layout based on the sorted order
-        for layout in [
-                self.positive_tags_layout, self.negative_tags_layout,
-                self.tags_removal_layout, self.tags_edit_layout
-        ]:  # Include tags_edit_layout
-            layout_key = None
-            if layout == self.positive_tags_layout:
-                layout_key = 'positive'
-            elif layout == self.negative_tags_layout:
-                layout_key = 'negative'
-            elif layout == self.tags_removal_layout:
-                layout_key = 'removal'
-            elif layout == self.tags_edit_layout:
-                layout_key = 'edit'  # Handle the edit layout key here
-
-            # Clear the existing widgets in the layout
-            for _ in range(layout.count()):
-                widget = layout.itemAt(0).widget()
-                layout.removeWidget(widget)
-
-            # Add widgets back according to the sorted order
-            for tag, buttons in self.tag_buttons_dict.items():
-                button = buttons[layout_key]
-                layout.addWidget(button)
+        self.removal_tag_cloud.schedule_filter(
+            self.tag_removal_filter_edit.text())
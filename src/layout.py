@@ -1,73 +1,45 @@
-from PyQt5.QtWidgets import QLayout
-from PyQt5.QtCore import QRect, QSize, QPoint
-
-
-class FlowLayout(QLayout):
-
-    def __init__(self, parent=None, margin=0, spacing=0):
-        super().__init__(parent)
-        self.setSpacing(spacing)
-        if parent is not None:
-            self.setContentsMargins(margin, margin, margin, margin)
-        self.itemList = []
-
-    def addItem(self, item):
-        self.itemList.append(item)
-
-    def count(self):
-        return len(self.itemList)
-
-    def itemAt(self, index):
-        if 0 <= index < len(self.itemList):
-            return self.itemList[index]
-        return None
-
-    def takeAt(self, index):
-        if 0 <= index < len(self.itemList):
-            return self.itemList.pop(index)
-        return None
-
-    def hasHeightForWidth(self):
-        return True
-
-    def heightForWidth(self, width):
-        return self.doLayout(QRect(0, 0, width, 0), True)
-
-    def setGeometry(self, rect):
-        super().setGeometry(rect)
-        self.doLayout(rect, False)
-
-    def sizeHint(self):
-        return self.minimumSize()
-
-    def minimumSize(self):
-        size = QSize()
-        for item in self.itemList:
-            size = size.expandedTo(item.minimumSize())
-        left, top, right, bottom = self.getContentsMargins()
-        size += QSize(left + right, top + bottom)
-        return size
-
-    def doLayout(self, rect, testOnly=False):
-        x = rect.x()
-        y = rect.y()
-        lineHeight = 0
-
-        for item in self.itemList:
-            widget = item.widget()
-            widget.setContentsMargins(0, 0, 0, 0)
-            spaceX = self.spacing() + self.contentsMargins().left(
-            ) + self.contentsMargins().right()
-            spaceY = self.spacing() + self.contentsMargins().top(
-            ) + self.contentsMargins().bottom()
-            nextX = x + item.sizeHint().width() + spaceX
-            if nextX - spaceX > rect.right() and lineHeight > 0:
-                x = rect.x()
-                y = y + lineHeight + spaceY
-                nextX = x + item.sizeHint().width() + spaceX
-                lineHeight = 0
-            if not testOnly:
-                item.setGeometry(QRect(QPoint(x, y), item.sizeHint()))
-            x = nextX
-            lineHeight = max(lineHeight, item.sizeHint().height())
-        return y + lineHeight - rect.y()
+from bisect import bisect_right
+
+
+def break_lines(widths, available_width, spacing, start=0):
+    # Greedy line breaking of the tag cloud: returns the index of the first
+    # item of every line, beginning with a line at start. An item wraps when
+    # it would reach past available_width, unless it is the first item of
+    # its line.
+    line_starts = []
+    x = 0
+    for index in range(start, len(widths)):
+        width = widths[index]
+        if not line_starts or x + width > available_width:
+            line_starts.append(index)
+            x = 0
+        x += width + spacing
+    return line_starts
+
+
+class LineBreaks:
+    """First item of each line at one width. Lines from resume_at on are
+    stale and get recomputed by complete(); resume_at is None once every
+    line is known."""
+
+    def __init__(self):
+        self.starts = []
+        self.resume_at = 0
+
+    def truncate(self, index):
+        # Drop the line holding item index and all the lines after it. When
+        # the item starts its line, the previous line may now take it too.
+        if self.resume_at is not None and index > self.resume_at:
+            return
+        line = max(0, bisect_right(self.starts, index) - 1)
+        if line > 0 and self.starts[line] == index:
+            line -= 1
+        self.resume_at = self.starts[line] if line < len(self.starts) else 0
+        del self.starts[line:]
+
+    def complete(self, widths, available_width, spacing):
+        if self.resume_at is None:
+            return
+        self.starts.extend(
+            break_lines(widths, available_width, spacing, self.resume_at))
+        self.resume_at = None
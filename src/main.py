@@ -10,6 +10,7 @@ from sortedcontainers import SortedDict
 from stylesheet import css
 
 from imgbrowser import ImageBrowser
+from perf import setup_logging
 # class CustomScrollArea(QScrollArea):
 
 #     def __init__(self, parent=None):
@@ -1227,6 +1228,7 @@ from imgbrowser import ImageBrowser
 #                 layout.addWidget(button)
 
 if __name__ == "__main__":
+    setup_logging()
     app = QApplication([])
 
     # Load the stylesheet from the CSS file
@@ -0,0 +1,258 @@
+import argparse
+import json
+import logging
+import os
+import tempfile
+
+try:
+    import zstandard
+except ImportError:  # Compressed manifests are not available then
+    zstandard = None
+
+from captions import read_caption
+from captionwriter import file_mode, fsync_directory, write_captions
+
+MANIFEST_FILE = "captions.jsonl"
+COMPRESSED_MANIFEST_FILE = "captions.jsonl.zst"
+_COMPACT_MIN = 1024  # Appended records tolerated before compacting
+_EXPORT_BATCH = 128  # Caption files written per group of fsyncs
+_READ_SIZE = 1 << 20
+
+log = logging.getLogger(__name__)
+
+
+def manifest_names():
+    """File names taken for a manifest, the preferred one first."""
+    if zstandard is None:
+        return (MANIFEST_FILE, )
+    return (COMPRESSED_MANIFEST_FILE, MANIFEST_FILE)
+
+
+class CaptionManifest:
+    """Captions of a whole dataset in one JSON lines file, optionally
+    zstandard compressed. Each line is one record:
+
+        {"image": "0001.png", "tags": ["1girl", "long hair"]}
+
+    Saving appends the records of the changed images, a new zstd frame in
+    the compressed file, so a save is one write and one fsync however big
+    the dataset is. A later record of an image replaces the earlier ones.
+    Once the appended records outnumber a quarter of the images, the file
+    is compacted: rewritten with one record per image and swapped in with
+    os.replace. A record torn by a crash is skipped when reading, and the
+    next save compacts the file before appending to it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.compressed = path.endswith(".zst")
+        self.images = 0  # Distinct images in the file
+        self.appended = 0  # Records beyond one per image
+        self.damaged = False  # Ends in a torn record
+
+    def decompressed_chunks(self, file):
+        # Frame by frame, so a damaged frame at the end, as left by a crash
+        # during a save, does not take the frames before it along
+        decompressor = zstandard.ZstdDecompressor()
+        frame = decompressor.decompressobj()
+        while True:
+            data = file.read(_READ_SIZE)
+            if not data:
+                return
+            while data:
+                try:
+                    yield frame.decompress(data)
+                except zstandard.ZstdError:
+                    self.damaged = True
+                    return
+                if not frame.eof:
+                    break
+                data = frame.unused_data
+                frame = decompressor.decompressobj()
+
+    def lines(self, file):
+        if not self.compressed:
+            yield from file
+            return
+        rest = b""
+        for chunk in self.decompressed_chunks(file):
+            lines = (rest + chunk).split(b"\n")
+            rest = lines.pop()
+            for line in lines:
+                yield line + b"\n"
+        if rest:
+            yield rest
+
+    def records(self):
+        """(image, tags) of every record, in file order."""
+        with open(self.path, "rb") as file:
+            for line in self.lines(file):
+                if not line.endswith(b"\n"):
+                    self.damaged = True  # Torn by a crash while appending
+                    break
+                try:
+                    record = json.loads(line)
+                    yield record["image"], record["tags"]
+                except (ValueError, KeyError, TypeError):
+                    self.damaged = True
+        if self.damaged:
+            log.warning("Skipped damaged records in %s", self.path)
+
+    def load(self, encode=None):
+        """{image: tags} of the latest record of every image. With encode,
+        the tags are stripped, deduplicated and passed to it as a set."""
+        self.damaged = False
+        captions = {}
+        count = 0
+        for image, tags in self.records():
+            captions[image] = tags
+            count += 1
+        self.images = len(captions)
+        self.appended = count - len(captions)
+        if encode is None:
+            return captions
+        # Encoded only once, superseded records are skipped
+        encoded = {}
+        for image, tags in captions.items():
+            tags = set(map(str.strip, tags))
+            tags.discard("")
+            encoded[image] = encode(tags)
+        return encoded
+
+    def record(self, image):
+        """Tags of the latest record of image, None without one."""
+        tags = None
+        for name, record_tags in self.records():
+            if name == image:
+                tags = record_tags
+        return tags
+
+    def encode_records(self, records):
+        lines = [
+            json.dumps(dict(image=image, tags=list(tags)), ensure_ascii=False)
+            for image, tags in records
+        ]
+        data = "".join(line + "\n" for line in lines).encode("utf-8")
+        if self.compressed:
+            data = zstandard.ZstdCompressor(level=3).compress(data)
+        return data
+
+    def write(self, records):
+        """Replace the file with records, atomically."""
+        directory = os.path.dirname(self.path) or "."
+        prefix = "." + os.path.basename(self.path) + "."
+        fd, temp_path = tempfile.mkstemp(dir=directory,
+                                         prefix=prefix,
+                                         suffix=".tmp")
+        records = list(records)
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(self.encode_records(records))
+                file.flush()
+                os.fsync(file.fileno())
+            os.chmod(temp_path, file_mode(self.path))
+            os.replace(temp_path, self.path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        fsync_directory(directory)
+        self.images = len(records)
+        self.appended = 0
+        self.damaged = False
+
+    def compact(self):
+        # Superseded and damaged records are dropped, images the app does
+        # not know about are kept
+        self.write(self.load().items())
+
+    def append(self, jobs):
+        """Save (image, path, tags) jobs, with the interface of
+        captionwriter.write_captions(); path is not used."""
+        try:
+            if self.damaged:
+                self.compact()
+            data = self.encode_records(
+                (image, tags) for image, _, tags in jobs)
+            with open(self.path, "ab") as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            self.appended += len(jobs)
+            if self.appended > max(_COMPACT_MIN, self.images // 4):
+                self.compact()
+        except OSError as e:
+            return [], [(image, str(e)) for image, _, _ in jobs]
+        return [(image, None) for image, _, _ in jobs], []
+
+
+def import_text_captions(folder_path, compress=False):
+    """Write a manifest with the .txt caption of every image in
+    folder_path; images without one get an empty record."""
+    from scanner import DatasetScanner
+
+    dataset = DatasetScanner().scan(folder_path)
+    name = COMPRESSED_MANIFEST_FILE if compress else MANIFEST_FILE
+    manifest = CaptionManifest(os.path.join(folder_path, name))
+    records = []
+    for image_file in dataset.image_files:
+        tags = set()
+        tag_file_path = dataset.sidecars[image_file]
+        if tag_file_path is not None:
+            tags = read_caption(tag_file_path)
+        records.append((image_file, sorted(tags)))
+    manifest.write(records)
+    return manifest
+
+
+def export_text_captions(manifest_path):
+    """Write every record of the manifest to the .txt caption next to its
+    image. Returns the failed [(image, error)]."""
+    manifest = CaptionManifest(manifest_path)
+    folder_path = os.path.dirname(manifest_path)
+    jobs = []
+    for image, tags in manifest.load().items():
+        path = os.path.join(folder_path, os.path.splitext(image)[0] + ".txt")
+        jobs.append((image, path, ", ".join(tags)))
+    failed = []
+    for start in range(0, len(jobs), _EXPORT_BATCH):
+        failed.extend(write_captions(jobs[start:start + _EXPORT_BATCH])[1])
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert a dataset between .txt captions and a caption "
+        "manifest.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser(
+        "import", help="write a manifest from the .txt captions")
+    import_parser.add_argument("folder")
+    import_parser.add_argument("--compress",
+                               action="store_true",
+                               help=f"write {COMPRESSED_MANIFEST_FILE}")
+    export_parser = subparsers.add_parser(
+        "export", help="write the .txt captions from the manifest")
+    export_parser.add_argument("folder")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        if args.compress and zstandard is None:
+            parser.error("--compress needs the zstandard package")
+        manifest = import_text_captions(args.folder, args.compress)
+        print(f"Wrote {manifest.images} captions to {manifest.path}")
+        return
+    for name in manifest_names():
+        path = os.path.join(args.folder, name)
+        if os.path.exists(path):
+            failed = export_text_captions(path)
+            for image, error in failed:
+                print(f"Error writing the caption of {image}: {error}")
+            return
+    parser.error(f"No caption manifest in {args.folder}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import json
+import logging
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtWidgets import QLabel
+
+import settings
+
+# Timing spans and counters of the hot paths. Both are only recorded while
+# enabled, so the calls left in the code cost one global lookup otherwise.
+enabled = settings.PROFILE
+recent_spans = deque(maxlen=settings.PROFILE_SPANS)  # (name, ms, fields)
+counters = Counter()
+_counter_lock = threading.Lock()  # Decodes and saves count from workers
+
+span_log = logging.getLogger("perf")
+
+
+def set_enabled(state):
+    global enabled
+    enabled = state
+
+
+class _Span:
+    __slots__ = ("name", "fields", "start")
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        _record(self.name, time.perf_counter() - self.start, self.fields)
+        return False
+
+
+class _NoSpan:
+    # Shared by every span while disabled
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, **fields):
+    """Context manager timing its block as the span name. fields are
+    logged with it, so they should be cheap to compute."""
+    if not enabled:
+        return _NO_SPAN
+    return _Span(name, fields)
+
+
+def _record(name, seconds, fields):
+    ms = seconds * 1000
+    recent_spans.append((name, ms, fields))
+    if span_log.isEnabledFor(logging.DEBUG):
+        span_log.debug("%s %.2f ms%s",
+                       name,
+                       ms,
+                       "".join(f" {key}={value}"
+                               for key, value in fields.items()),
+                       extra={
+                           "span": name,
+                           "ms": round(ms, 3),
+                           "fields": fields
+                       })
+
+
+def count(name, amount=1):
+    if enabled:
+        with _counter_lock:
+            counters[name] += amount
+
+
+def log_counters():
+    if counters:
+        span_log.info("counters %s",
+                      ", ".join(f"{name}={value}"
+                                for name, value in sorted(counters.items())),
+                      extra={"counters": dict(counters)})
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the span or counters of the record
+    as fields of their own."""
+
+    def format(self, record):
+        entry = {
+            "time": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        for key in ("span", "ms", "fields", "counters", "stall_ms", "stacks"):
+            if hasattr(record, key):
+                entry[key] = getattr(record, key)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def setup_logging(level=settings.LOG_LEVEL,
+                  output_format=settings.LOG_FORMAT,
+                  path=settings.LOG_FILE):
+    """Send the log to path, or stderr, as text or JSON lines."""
+    if path:
+        handler = logging.FileHandler(path, encoding="utf-8")
+    else:
+        handler = logging.StreamHandler(sys.stderr)
+    if output_format == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(
+            logging.Formatter("%(asctime)s %(levelname)-7s %(name)s: "
+                              "%(message)s"))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(getattr(logging, level.upper(), logging.WARNING))
+
+
+class PerfOverlay(QLabel):
+    """Last spans and the counters, drawn over the top right corner of its
+    parent. Profiling is on while it is shown."""
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.setStyleSheet("background-color: rgba(0, 0, 0, 180);"
+                           "color: #e0e0e0; font-family: monospace;"
+                           "padding: 6px;")
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(500)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.hide()
+
+    def toggle(self):
+        if self.isVisible():
+            self.refresh_timer.stop()
+            self.hide()
+            set_enabled(settings.PROFILE)
+            return
+        set_enabled(True)
+        self.refresh()
+        self.show()
+        self.raise_()
+        self.refresh_timer.start()
+
+    def refresh(self):
+        # Copies first, workers may be adding to them
+        lines = [
+            f"{name:<28}{ms:>10.2f} ms" for name, ms, _ in list(recent_spans)
+        ]
+        with _counter_lock:
+            counted = sorted(counters.items())
+        lines.extend(f"{name:<28}{value:>10}" for name, value in counted)
+        self.setText("\n".join(lines) or "No spans yet")
+        self.adjustSize()
+        self.move(self.parentWidget().width() - self.width() - 10, 10)
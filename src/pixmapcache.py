@@ -0,0 +1,76 @@
+from collections import OrderedDict
+
+
+class PixmapCache:
+    """LRU cache of decoded images bounded by a byte budget.
+
+    Values can be QImage or QPixmap; their cost is width x height x depth,
+    which is what they occupy in memory once decoded. The hit, miss and
+    eviction counters are there to help tuning the budget for a machine.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (image, cost)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def cost(image):
+        return image.width() * image.height() * image.depth() // 8
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def peek(self, key):
+        # Lookup that leaves the LRU order and the counters alone
+        entry = self.entries.get(key)
+        return None if entry is None else entry[0]
+
+    def put(self, key, image):
+        self.discard(key)
+        cost = self.cost(image)
+        if cost > self.max_bytes:
+            return
+        self.entries[key] = (image, cost)
+        self.total_bytes += cost
+        self.evict(self.max_bytes)
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[1]
+
+    def evict(self, max_bytes):
+        while self.total_bytes > max_bytes and self.entries:
+            _, (_, cost) = self.entries.popitem(last=False)
+            self.total_bytes -= cost
+            self.evictions += 1
+
+    def set_budget(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.evict(max_bytes)
+
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+    def __str__(self):
+        return (f"Cache {self.total_bytes / 2**20:.0f}/"
+                f"{self.max_bytes / 2**20:.0f} MB, {len(self.entries)} images,"
+                f" {self.hits} hits, {self.misses} misses,"
+                f" {self.evictions} evictions")
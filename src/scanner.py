@@ -0,0 +1,93 @@
+import os
+import time
+
+from manifest import manifest_names
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
+
+
+class DatasetScan:
+    """Result of one pass over a dataset folder.
+
+    image_files keeps the directory order, sidecars maps each image file to
+    its .txt caption path (None when it has none). The DirEntry objects are
+    kept so stat() results are fetched at most once per file. A folder with
+    a caption manifest has manifest_path set, and its .txt files are not
+    used.
+    """
+
+    def __init__(self, folder_path):
+        self.folder_path = folder_path
+        self.image_files = []
+        self.sidecars = {}
+        self.entries = {}  # file name -> os.DirEntry
+        self.entry_count = 0
+        self.manifest_path = None
+        self.scan_time = 0.0
+
+    def image_path(self, image_file):
+        return os.path.join(self.folder_path, image_file)
+
+    def sidecar_path(self, image_file):
+        return os.path.join(self.folder_path,
+                            os.path.splitext(image_file)[0] + '.txt')
+
+    def stat(self, file_name):
+        # DirEntry caches its stat result after the first call
+        entry = self.entries.get(file_name)
+        if entry is None:
+            return os.stat(os.path.join(self.folder_path, file_name))
+        return entry.stat()
+
+    def add_sidecar(self, image_file):
+        # Record a caption file created after the scan
+        self.sidecars[image_file] = self.sidecar_path(image_file)
+
+    def summary(self):
+        if self.manifest_path is not None:
+            captions = f"captions in {os.path.basename(self.manifest_path)}"
+        else:
+            captions = (f"{sum(1 for path in self.sidecars.values() if path)}"
+                        " captions")
+        return (f"Scanned {self.entry_count} entries: "
+                f"{len(self.image_files)} images, {captions} "
+                f"in {self.scan_time:.2f}s")
+
+
+class DatasetScanner:
+    """Lists a dataset folder with a single os.scandir call and pairs every
+    image with its caption from that same listing, instead of listing the
+    folder again and stat'ing each sidecar separately."""
+
+    def scan(self, folder_path):
+        start = time.perf_counter()
+        result = DatasetScan(folder_path)
+        text_files = set()
+        manifests = set()
+        names = manifest_names()
+        with os.scandir(folder_path) as entries:
+            for entry in entries:
+                result.entry_count += 1
+                name = entry.name
+                lower_name = name.lower()
+                if lower_name.endswith(IMAGE_EXTENSIONS):
+                    if entry.is_file():
+                        result.image_files.append(name)
+                        result.entries[name] = entry
+                elif lower_name.endswith('.txt'):
+                    text_files.add(name)
+                    result.entries[name] = entry
+                elif name in names:
+                    manifests.add(name)
+
+        for image_file in result.image_files:
+            sidecar_file = os.path.splitext(image_file)[0] + '.txt'
+            result.sidecars[image_file] = (os.path.join(
+                folder_path, sidecar_file) if sidecar_file in text_files else
+                                           None)
+        for name in names:
+            if name in manifests:
+                result.manifest_path = os.path.join(folder_path, name)
+                break
+        result.scan_time = time.perf_counter() - start
+        return result
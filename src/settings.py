@@ -0,0 +1,67 @@
+import os
+import sys
+
+# Tunables that can be overridden from the environment, so the same build can
+# be adjusted for a big workstation or a small laptop without code changes.
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+# Number of background threads decoding thumbnails (0 = one per CPU core)
+THUMBNAIL_WORKERS = _env_int("TAGGER_THUMBNAIL_WORKERS", 0)
+
+
+def _default_cache_dir():
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser(
+            "~/.cache")
+    return os.path.join(base, "anzhc-dataset-tagger")
+
+
+# Root directory for everything the tagger caches between sessions
+CACHE_DIR = os.environ.get("TAGGER_CACHE_DIR") or _default_cache_dir()
+
+# Size limit of the on-disk thumbnail cache in megabytes (0 = disabled)
+THUMBNAIL_CACHE_MB = _env_int("TAGGER_THUMBNAIL_CACHE_MB", 2048)
+
+# Memory budget of the in-memory decoded image cache in megabytes
+PIXMAP_CACHE_MB = _env_int("TAGGER_PIXMAP_CACHE_MB", 1024)
+
+# Threads reading caption files; the work is I/O bound, so this can exceed
+# the number of cores, especially on network shares
+CAPTION_WORKERS = _env_int("TAGGER_CAPTION_WORKERS", 16)
+
+# Extra consistency checks of the incremental tag data structures
+DEBUG = os.environ.get("TAGGER_DEBUG", "") not in ("", "0")
+
+# Keep a snapshot of the parsed captions of every opened folder under
+# CACHE_DIR, so reopening a folder only reads the captions that changed
+DATASET_INDEX = os.environ.get("TAGGER_DATASET_INDEX", "1") not in ("", "0")
+
+# Datasets with at least this many images keep their tags in an SQLite
+# database under CACHE_DIR instead of in memory (0 = never). It is a working
+# store for the session, deleted on exit; the captions stay the saved state
+SQLITE_MIN_IMAGES = _env_int("TAGGER_SQLITE_MIN_IMAGES", 1000000)
+
+# Log level (DEBUG, INFO, WARNING or ERROR) and format: "text", or "json" for
+# one JSON object per line. The log goes to TAGGER_LOG_FILE when set, else to
+# stderr.
+LOG_LEVEL = os.environ.get("TAGGER_LOG_LEVEL", "WARNING")
+LOG_FORMAT = os.environ.get("TAGGER_LOG_FORMAT", "text")
+LOG_FILE = os.environ.get("TAGGER_LOG_FILE", "")
+
+# Record timing spans and counters of the hot paths; the spans are logged at
+# DEBUG level. F12 shows the last PROFILE_SPANS of them over the window.
+PROFILE = os.environ.get("TAGGER_PROFILE", "") not in ("", "0")
+PROFILE_SPANS = _env_int("TAGGER_PROFILE_SPANS", 20)
+
+# Log a report with the GUI thread's stack whenever the event loop stalls for
+# at least this many milliseconds (0 = off)
+WATCHDOG_MS = _env_int("TAGGER_WATCHDOG_MS", 0)
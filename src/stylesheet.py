@@ -103,4 +103,10 @@ QScrollBar::add-page, QScrollBar::sub-page {
 QScrollArea {
     background-color: #1e1e1e; /* Set the desired color for the scroll area background */
 }
+
+/* Image gallery */
+QListView {
+    background-color: #1e1e1e;
+    border: 1px solid #5A5A5A;
+}
 """
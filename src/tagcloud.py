@@ -0,0 +1,327 @@
+from bisect import bisect_left
+from collections import OrderedDict
+
+from PyQt5.QtWidgets import QAbstractScrollArea
+from PyQt5.QtCore import Qt, QObject, QRect, QSize, QTimer, pyqtSignal
+from PyQt5.QtGui import QColor, QFont, QFontMetrics, QPainter, QPen
+
+from layout import LineBreaks
+import perf
+
+CACHED_WIDTHS = 8  # Line breaks are kept for this many viewport widths
+
+
+class TagCloudModel(QObject):
+    """Tags of one cloud in display order, with their counts and which of
+    them are checked.
+
+    Every cloud has its own model, and so its own checked state, while the
+    tag list and the counts dict are shared between them.
+    """
+
+    tags_changed = pyqtSignal()
+    checked_changed = pyqtSignal()
+    toggled = pyqtSignal(str, bool)
+
+    def __init__(self, show_counts=True, parent=None):
+        super().__init__(parent)
+        self.show_counts = show_counts
+        self.tags = []
+        self.counts = {}
+        self.changed_tags = None
+        self.checked = set()
+
+    def set_tags(self, tags, counts, changed_tags=None):
+        # changed_tags: the tags added, removed or recounted since the last
+        # call, None when any of them may have been
+        self.tags = tags
+        self.counts = counts
+        self.changed_tags = changed_tags
+        self.tags_changed.emit()
+
+    def label(self, tag):
+        if self.show_counts:
+            return f"{tag} ({self.counts.get(tag, 0)})"
+        return tag
+
+    def is_checked(self, tag):
+        return tag in self.checked
+
+    def set_checked_tags(self, tags):
+        tags = set(tags)
+        if tags != self.checked:
+            self.checked = tags
+            self.checked_changed.emit()
+
+    def toggle(self, tag):
+        state = tag not in self.checked
+        if state:
+            self.checked.add(tag)
+        else:
+            self.checked.discard(tag)
+        self.checked_changed.emit()
+        self.toggled.emit(tag, state)
+
+
+def first_changed_row(rows, positions, changed_tags):
+    # rows follow the order of positions, in which the other tags keep
+    # their order, so every row before the first changed tag is unchanged
+    first = min((positions[tag] for tag in changed_tags if tag in positions),
+                default=None)
+    if first is None:
+        return len(rows)
+    return bisect_left(rows, first, key=positions.__getitem__)
+
+
+class TagCloudView(QAbstractScrollArea):
+    """Scrollable cloud of tag chips painted straight onto the viewport.
+
+    This replaces one QPushButton per tag and cloud. Chip widths are kept
+    per tag until its count changes, and the line breaks are cached for the
+    last few viewport widths. When the model names the tags that changed,
+    the chips before the first changed row keep their widths and lines,
+    and only the lines from there on are broken again. Painting and hit
+    testing only look at the lines inside the viewport. Clicking a chip
+    toggles it in the model.
+
+    Filter text typed into a box is applied once typing pauses. A query
+    that extends the previous one narrows the rows already shown; any
+    other query is looked up in the shared TagSearchIndex.
+    """
+
+    # Same box as the QPushButton style sheet: 5px 10px padding, 80px wide
+    PADDING_X = 10
+    PADDING_Y = 5
+    MIN_WIDTH = 80
+    SPACING = 2
+    FILTER_DELAY = 150  # ms without typing before the filter is applied
+
+    def __init__(self, model=None, search_index=None, parent=None):
+        super().__init__(parent)
+        self.model = None
+        self.search_index = search_index
+        self.positions = {}  # tag -> position in the model's tag list
+        self.filter_text = ""
+        self.pending_filter = ""
+        self.rows = []  # Tags passing the filter, in display order
+        self.widths = []  # Chip width of each row
+        self.tag_widths = {}  # tag -> chip width
+        self.line_cache = OrderedDict()  # viewport width -> LineBreaks
+        self.line_starts = []  # Row of the first chip on each line
+        self.layout_width = -1
+        self.pressed_tag = None
+        self.hovered_tag = None
+
+        self.chip_font = QFont(self.font())
+        self.chip_font.setBold(True)
+        self.metrics = QFontMetrics(self.chip_font)
+        self.chip_height = self.metrics.height() + 2 * self.PADDING_Y + 2
+        self.line_pitch = self.chip_height + self.SPACING
+
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.verticalScrollBar().setSingleStep(self.line_pitch)
+        self.viewport().setMouseTracking(True)
+
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(self.FILTER_DELAY)
+        self.filter_timer.timeout.connect(
+            lambda: self.set_filter(self.pending_filter))
+        if model is not None:
+            self.set_model(model)
+
+    def set_model(self, model):
+        self.model = model
+        model.tags_changed.connect(self.refilter)
+        model.checked_changed.connect(self.viewport().update)
+        self.refilter()
+
+    def schedule_filter(self, text):
+        # Called on every keystroke, the filter follows once typing pauses
+        self.pending_filter = text
+        self.filter_timer.start()
+
+    def set_filter(self, text):
+        self.filter_timer.stop()
+        if text == self.filter_text:
+            return
+        previous_text, self.filter_text = self.filter_text, text
+        if previous_text and previous_text in text:
+            # Every match of the longer query is among the current rows
+            self.rows = [tag for tag in self.rows if text in tag]
+            self.update_rows(0)
+        else:
+            self.find_rows()
+            self.update_rows(0)
+
+    def refilter(self):
+        # The tags changed, match the filter against the whole list again
+        changed_tags = self.model.changed_tags
+        old_rows, old_positions = self.rows, self.positions
+        self.positions = {
+            tag: index
+            for index, tag in enumerate(self.model.tags)
+        }
+        self.find_rows()
+        if changed_tags is None:
+            self.tag_widths.clear()
+            self.update_rows(0)
+            return
+        for tag in changed_tags:
+            self.tag_widths.pop(tag, None)  # Its label has a new count
+        self.update_rows(
+            min(first_changed_row(old_rows, old_positions, changed_tags),
+                first_changed_row(self.rows, self.positions, changed_tags)))
+
+    def find_rows(self):
+        filter_text = self.filter_text
+        if not filter_text:
+            self.rows = list(self.model.tags)
+        elif self.search_index is None:
+            self.rows = [tag for tag in self.model.tags if filter_text in tag]
+        else:
+            positions = self.positions
+            self.rows = sorted(
+                (tag for tag in self.search_index.search(filter_text)
+                 if tag in positions),
+                key=positions.__getitem__)
+
+    def update_rows(self, first_changed):
+        # Rows before first_changed are the same chips as before
+        chip_width = self.chip_width
+        widths = self.widths[:first_changed]
+        widths.extend(chip_width(tag) for tag in self.rows[first_changed:])
+        self.widths = widths
+        for lines in self.line_cache.values():
+            lines.truncate(first_changed)
+        self.relayout()
+
+    def chip_width(self, tag):
+        width = self.tag_widths.get(tag)
+        if width is None:
+            width = max(
+                self.MIN_WIDTH,
+                self.metrics.horizontalAdvance(self.model.label(tag)) +
+                2 * self.PADDING_X + 2)
+            self.tag_widths[tag] = width
+        return width
+
+    def relayout(self):
+        self.layout_width = self.viewport().width()
+        lines = self.line_cache.get(self.layout_width)
+        if lines is None:
+            lines = self.line_cache[self.layout_width] = LineBreaks()
+            if len(self.line_cache) > CACHED_WIDTHS:
+                self.line_cache.popitem(last=False)
+        else:
+            self.line_cache.move_to_end(self.layout_width)
+        with perf.span("tag_cloud.layout", chips=len(self.widths)):
+            lines.complete(self.widths, self.layout_width, self.SPACING)
+        self.line_starts = lines.starts
+        self.update_scroll_range()
+        self.viewport().update()
+
+    def update_scroll_range(self):
+        content_height = len(self.line_starts) * self.line_pitch
+        viewport_height = self.viewport().height()
+        scroll_bar = self.verticalScrollBar()
+        scroll_bar.setPageStep(viewport_height)
+        scroll_bar.setRange(0, max(0, content_height - viewport_height))
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        if self.viewport().width() != self.layout_width:
+            self.relayout()
+        else:
+            self.update_scroll_range()
+
+    def sizeHint(self):
+        return QSize(400, 200)
+
+    def visible_lines(self, top, height):
+        first = max(0, top // self.line_pitch)
+        last = min(len(self.line_starts),
+                   (top + height) // self.line_pitch + 1)
+        return range(first, last)
+
+    def line_rows(self, line):
+        if line + 1 < len(self.line_starts):
+            return range(self.line_starts[line], self.line_starts[line + 1])
+        return range(self.line_starts[line], len(self.rows))
+
+    def chip_at(self, pos):
+        top = self.verticalScrollBar().value()
+        y = pos.y() + top
+        line = y // self.line_pitch
+        if (y < 0 or line >= len(self.line_starts)
+                or y - line * self.line_pitch >= self.chip_height):
+            return None
+        x = 0
+        for row in self.line_rows(line):
+            width = self.widths[row]
+            if x <= pos.x() < x + width:
+                return self.rows[row]
+            x += width + self.SPACING
+        return None
+
+    def scrollContentsBy(self, dx, dy):
+        self.viewport().update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self.viewport())
+        painter.setFont(self.chip_font)
+        top = self.verticalScrollBar().value()
+        exposed = event.rect()
+        painted = 0
+        for line in self.visible_lines(top + exposed.top(), exposed.height()):
+            x = 0
+            y = line * self.line_pitch - top
+            for row in self.line_rows(line):
+                width = self.widths[row]
+                self.paint_chip(painter, QRect(x, y, width, self.chip_height),
+                                self.rows[row])
+                x += width + self.SPACING
+                painted += 1
+        perf.count("tag_cloud.chips_painted", painted)
+
+    def paint_chip(self, painter, rect, tag):
+        # Mirrors the QPushButton rules of the style sheet
+        if self.model.is_checked(tag):
+            background, border, border_width = "#181818", "#721212", 3
+        elif tag == self.hovered_tag:
+            background, border, border_width = "#5A5A5A", "#6A6A6A", 1
+        else:
+            background, border, border_width = "#4A4A4A", "#6A6A6A", 1
+        painter.fillRect(rect, QColor(border))
+        painter.fillRect(
+            rect.adjusted(border_width, border_width, -border_width,
+                          -border_width), QColor(background))
+        painter.setPen(QPen(QColor("#EAEAEA")))
+        painter.drawText(rect, Qt.AlignCenter, self.model.label(tag))
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            self.pressed_tag = self.chip_at(event.pos())
+        super().mousePressEvent(event)
+
+    def mouseReleaseEvent(self, event):
+        # Like a button, the click counts if released over the same chip
+        tag = self.pressed_tag
+        self.pressed_tag = None
+        if (event.button() == Qt.LeftButton and tag is not None
+                and self.chip_at(event.pos()) == tag):
+            self.model.toggle(tag)
+        super().mouseReleaseEvent(event)
+
+    def mouseMoveEvent(self, event):
+        tag = self.chip_at(event.pos())
+        if tag != self.hovered_tag:
+            self.hovered_tag = tag
+            self.viewport().update()
+        super().mouseMoveEvent(event)
+
+    def leaveEvent(self, event):
+        if self.hovered_tag is not None:
+            self.hovered_tag = None
+            self.viewport().update()
+        super().leaveEvent(event)
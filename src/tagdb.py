@@ -0,0 +1,345 @@
+import os
+import sqlite3
+import tempfile
+import time
+from array import array
+from collections import Counter, OrderedDict
+from itertools import groupby
+from operator import itemgetter
+
+from tagindex import TagIndex, bitmap_from_ids
+from tagstore import TagVocabulary
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    file TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS image_tags (
+    image_id INTEGER NOT NULL,
+    tag_id INTEGER NOT NULL,
+    PRIMARY KEY (image_id, tag_id)
+) WITHOUT ROWID;
+"""
+# Images of the mass edit being applied, joined against by its statements
+_EDIT_IMAGES = """
+CREATE TEMP TABLE IF NOT EXISTS edit_images (id INTEGER PRIMARY KEY)
+"""
+_TAG_INDEX = """
+CREATE INDEX IF NOT EXISTS image_tags_by_tag ON image_tags (tag_id, image_id)
+"""
+_BATCH = 4096  # Rows inserted per executemany in load_rows
+_CACHED_POSTINGS = 256  # Posting bitmaps kept by SqliteTagIndex
+_STALE_AFTER = 60  # Seconds before an unlocked database file counts as stale
+
+
+def _remove_database(path):
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(path + suffix)
+        except OSError:
+            pass
+
+
+def remove_stale_stores(directory):
+    """Delete the databases under directory left by sessions that crashed.
+
+    A store in use holds an exclusive lock on its database, so one that
+    can be locked is not. Files younger than a minute may belong to a
+    store that has not taken its lock yet and are left alone.
+    """
+    now = time.time()
+    for name in os.listdir(directory):
+        if not name.endswith(".sqlite"):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            if now - os.path.getmtime(path) < _STALE_AFTER:
+                continue
+            connection = sqlite3.connect(path, timeout=0)
+            try:
+                connection.execute("BEGIN EXCLUSIVE")
+                connection.rollback()
+            finally:
+                connection.close()
+        except (OSError, sqlite3.Error):
+            continue  # In use by another instance
+        _remove_database(path)
+
+
+class SqliteTagTable:
+    """TagTable kept in an SQLite database instead of in Python objects.
+
+    Rows live in image_tags(image_id, tag_id), whose primary key serves a
+    row and whose (tag_id, image_id) index serves a posting list, so only
+    the tag vocabulary stays in memory. An image is stored under its id in
+    image_ids, the gallery row, which lets SqliteTagIndex hand out bitmaps
+    straight from the index.
+
+    The interface is the one of TagTable, plus edit_tags() that edits
+    many images in a few set-based statements.
+    Edits since the last maybe_compact() are one open transaction,
+    committed together.
+
+    The database is a working store for one session, not a cache: it is
+    filled from the captions when a folder is opened and deleted on
+    close(). The captions on disk stay the saved state.
+    """
+
+    def __init__(self, path, image_ids=None):
+        self.path = path
+        self.image_ids = image_ids if image_ids is not None else {}
+        self.vocabulary = TagVocabulary()
+        self.connection = sqlite3.connect(path)
+        # Held until close(), which tells remove_stale_stores() that the
+        # database is in use
+        self.connection.execute("PRAGMA locking_mode=EXCLUSIVE")
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(_SCHEMA)
+        self.connection.execute(_TAG_INDEX)
+        self.connection.execute(_EDIT_IMAGES)
+
+    @classmethod
+    def create(cls, directory, image_ids=None):
+        """A table in a new database file under directory, deleted again by
+        close(). Files left there by crashed sessions are deleted first."""
+        os.makedirs(directory, exist_ok=True)
+        remove_stale_stores(directory)
+        fd, path = tempfile.mkstemp(suffix=".sqlite", dir=directory)
+        os.close(fd)
+        return cls(path, image_ids)
+
+    def close(self):
+        self.connection.close()
+        _remove_database(self.path)
+
+    def encode(self, tags):
+        return self.vocabulary.encode(tags)
+
+    def decode(self, row):
+        return self.vocabulary.decode(row)
+
+    def image_id(self, image_file):
+        result = self.connection.execute(
+            "SELECT id FROM images WHERE file = ?", (image_file, )).fetchone()
+        if result is None:
+            raise KeyError(image_file)
+        return result[0]
+
+    def insert_image(self, image_file):
+        # Inserts image_file under its gallery row; None if it was there
+        cursor = self.connection.execute(
+            "INSERT OR IGNORE INTO images (id, file) VALUES (?, ?)",
+            (self.image_ids.get(image_file), image_file))
+        return cursor.lastrowid if cursor.rowcount else None
+
+    def load_rows(self, rows):
+        """Append (image_file, encoded row) pairs in one transaction."""
+        # Loading into an empty table, the tag index is built afterwards in
+        # one sorted pass instead of updated by every insert
+        bulk = not len(self)
+        if bulk:
+            self.connection.execute("DROP INDEX IF EXISTS image_tags_by_tag")
+        insert = "INSERT INTO image_tags VALUES (?, ?)"
+        pairs = []
+        for image_file, row in rows:
+            image_id = self.insert_image(image_file)
+            if image_id is None:
+                self.set_row(image_file, row)
+                continue
+            pairs.extend((image_id, tag_id) for tag_id in row)
+            if len(pairs) >= _BATCH:
+                self.connection.executemany(insert, pairs)
+                pairs = []
+        self.connection.executemany(insert, pairs)
+        if bulk:
+            self.connection.execute(_TAG_INDEX)
+        self.connection.commit()
+
+    def row(self, image_file):
+        # The LEFT JOIN tells an image without tags from an unknown one
+        result = self.connection.execute(
+            "SELECT tag_id FROM images LEFT JOIN image_tags "
+            "ON image_id = id WHERE file = ? ORDER BY tag_id",
+            (image_file, )).fetchall()
+        if not result:
+            raise KeyError(image_file)
+        return array('I', [tag_id for tag_id, in result if tag_id is not None])
+
+    def set_row(self, image_file, row):
+        image_id = self.insert_image(image_file)
+        if image_id is None:
+            image_id = self.image_id(image_file)
+        self.connection.execute("DELETE FROM image_tags WHERE image_id = ?",
+                                (image_id, ))
+        self.connection.executemany("INSERT INTO image_tags VALUES (?, ?)",
+                                    ((image_id, tag_id) for tag_id in row))
+
+    def edit_tags(self, image_files, added_row, removed_row):
+        """Add the tag ids of added_row to every image of image_files and
+        remove those of removed_row, one statement per tag."""
+        images = [(self.image_ids[image_file], image_file)
+                  for image_file in image_files]
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO images (id, file) VALUES (?, ?)", images)
+        self.connection.execute("DELETE FROM edit_images")
+        self.connection.executemany("INSERT INTO edit_images VALUES (?)",
+                                    ((image_id, ) for image_id, _ in images))
+        self.connection.executemany(
+            "DELETE FROM image_tags WHERE tag_id = ? "
+            "AND image_id IN (SELECT id FROM edit_images)",
+            ((tag_id, ) for tag_id in removed_row))
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO image_tags SELECT id, ? FROM edit_images",
+            ((tag_id, ) for tag_id in added_row))
+
+    def maybe_compact(self):
+        # Called after a batch of edits, which is a transaction here
+        self.connection.commit()
+
+    def compact(self):
+        self.connection.commit()
+
+    def rows(self):
+        """(image_file, row of tag ids) pairs, without decoding."""
+        cursor = self.connection.execute(
+            "SELECT file, tag_id FROM images LEFT JOIN image_tags "
+            "ON image_id = id ORDER BY id, tag_id")
+        for image_file, pairs in groupby(cursor, key=itemgetter(0)):
+            yield image_file, array(
+                'I', [tag_id for _, tag_id in pairs if tag_id is not None])
+
+    def tag_counts(self):
+        """Number of images carrying each tag, counted by SQLite."""
+        tags = self.vocabulary.tags
+        return Counter({
+            tags[tag_id]: count
+            for tag_id, count in self.connection.execute(
+                "SELECT tag_id, COUNT(*) FROM image_tags GROUP BY tag_id")
+        })
+
+    def image_tag_counts(self):
+        """(image_id, number of tags) of every image with tags."""
+        return self.connection.execute(
+            "SELECT image_id, COUNT(*) FROM image_tags GROUP BY image_id")
+
+    def posting_ids(self, tag_id):
+        return [
+            image_id for image_id, in self.connection.execute(
+                "SELECT image_id FROM image_tags WHERE tag_id = ?", (tag_id, ))
+        ]
+
+    def clear(self):
+        self.vocabulary.clear()
+        self.connection.execute("DELETE FROM image_tags")
+        self.connection.execute("DELETE FROM images")
+        self.connection.commit()
+
+    # Mapping interface over sets of tag strings
+
+    def __len__(self):
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def __contains__(self, image_file):
+        return self.connection.execute("SELECT 1 FROM images WHERE file = ?",
+                                       (image_file, )).fetchone() is not None
+
+    def __iter__(self):
+        for image_file, in self.connection.execute(
+                "SELECT file FROM images ORDER BY id"):
+            yield image_file
+
+    def __getitem__(self, image_file):
+        return self.decode(self.row(image_file))
+
+    def __setitem__(self, image_file, tags):
+        self.set_row(image_file, self.encode(tags))
+
+    def get(self, image_file, default=None):
+        try:
+            return self[image_file]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        for image_file, row in self.rows():
+            yield image_file, self.decode(row)
+
+    def values(self):
+        for _, row in self.rows():
+            yield self.decode(row)
+
+
+class SqliteTagIndex(TagIndex):
+    """TagIndex over the postings of a SqliteTagTable.
+
+    Nothing is built up front: a tag's bitmap is made from the
+    (tag_id, image_id) index when it is first asked for, and the most
+    recently used ones are cached until an edit touches their tag. The
+    bitmaps by tag count are built on the first count query and then kept
+    up to date like TagIndex does.
+    """
+
+    def __init__(self, table):
+        super().__init__()
+        self.table = table
+        self.cache = OrderedDict()  # tag -> bitmap of image ids
+        self.tag_counts = None  # Built on first use
+
+    def rebuild(self, image_count, tags_by_id=(), tag_names=None):
+        # The postings are in the database already
+        self.cache.clear()
+        self.tag_counts = None
+        self.all_images = (1 << image_count) - 1
+
+    def update_image(self, image_id, old_tags, new_tags):
+        for tag in old_tags ^ new_tags:
+            self.cache.pop(tag, None)
+        if self.tag_counts is not None and len(old_tags) != len(new_tags):
+            self.move_count(1 << image_id, len(old_tags), len(new_tags))
+
+    def update_tags(self, tags):
+        # After edit_tags() of the table: the postings of tags and the
+        # counts per image are read again when next needed
+        for tag in tags:
+            self.cache.pop(tag, None)
+        self.tag_counts = None
+
+    def tags(self):
+        return self.table.vocabulary.tags
+
+    def posting(self, tag):
+        bitmap = self.cache.get(tag)
+        if bitmap is not None:
+            self.cache.move_to_end(tag)
+            return bitmap
+        tag_id = self.table.vocabulary.ids.get(tag)
+        if tag_id is None:
+            return 0
+        bitmap = bitmap_from_ids(self.table.posting_ids(tag_id))
+        self.cache[tag] = bitmap
+        if len(self.cache) > _CACHED_POSTINGS:
+            self.cache.popitem(last=False)
+        return bitmap
+
+    def union(self, tags):
+        bitmap = 0
+        for tag in tags:
+            bitmap |= self.posting(tag)
+        return bitmap
+
+    def with_tag_count(self, predicate):
+        if self.tag_counts is None:
+            ids_by_count = {}
+            for image_id, count in self.table.image_tag_counts():
+                ids_by_count.setdefault(count, []).append(image_id)
+            self.tag_counts = {
+                count: bitmap_from_ids(ids)
+                for count, ids in ids_by_count.items()
+            }
+        return super().with_tag_count(predicate)
@@ -0,0 +1,39 @@
+class TagEditTransaction:
+    """Collects tag changes for many images and applies them together.
+
+    Changes are handed to the commit callback as one {image_file: new tags}
+    dict, so indexes, counts and tag clouds are updated once per batch
+    rather than once per image. Used as a context manager, the batch is
+    committed when the block exits without an exception:
+
+        with browser.tag_transaction() as transaction:
+            transaction.set_tags(image_file, new_tags)
+    """
+
+    def __init__(self, commit):
+        self._commit = commit
+        self.changes = {}
+
+    def set_tags(self, image_file, new_tags):
+        self.changes[image_file] = set(new_tags)
+
+    def __len__(self):
+        return len(self.changes)
+
+    def commit(self):
+        changes, self.changes = self.changes, {}
+        if changes:
+            self._commit(changes)
+
+    def rollback(self):
+        self.changes = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
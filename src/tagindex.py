@@ -0,0 +1,127 @@
+def iter_ids(bitmap):
+    """Yield the positions of the set bits of bitmap, lowest first."""
+    # bin() runs in C, scanning its reversed digits is much faster than
+    # peeling bits off a large int one at a time
+    bits = bin(bitmap)[:1:-1]
+    position = bits.find('1')
+    while position >= 0:
+        yield position
+        position = bits.find('1', position + 1)
+
+
+def bitmap_from_ids(ids):
+    """Bitmap with the bits of ids set, built in one allocation."""
+    if not ids:
+        return 0
+    # OR-ing bits into an int one at a time copies it every time
+    buffer = bytearray((max(ids) >> 3) + 1)
+    for image_id in ids:
+        buffer[image_id >> 3] |= 1 << (image_id & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+class TagIndex:
+    """Inverted index from tag to the images carrying it.
+
+    Images are identified by their row in the gallery, and each posting list
+    is a Python int used as a bitmap over those ids, so gallery filters are
+    plain set algebra (|, &, ~) over a handful of ints. Images are also
+    indexed by how many tags they have, for the tags<op>N queries.
+    """
+
+    def __init__(self):
+        self.postings = {}  # tag -> bitmap of image ids
+        self.tag_counts = {}  # number of tags (> 0) -> bitmap of image ids
+        self.all_images = 0  # bitmap of every image in the dataset
+
+    def rebuild(self, image_count, tags_by_id, tag_names=None):
+        """tags_by_id: iterable of (image_id, tags). With tag_names, a list
+        of tags by tag id, tags are rows of tag ids as kept by TagTable."""
+        # Collect the ids per tag and tag count first, then make each bitmap
+        ids_by_count = {}
+        if tag_names is None:
+            ids_by_tag = {}
+            for image_id, tags in tags_by_id:
+                for tag in tags:
+                    ids = ids_by_tag.get(tag)
+                    if ids is None:
+                        ids = ids_by_tag[tag] = []
+                    ids.append(image_id)
+                if tags:
+                    ids_by_count.setdefault(len(tags), []).append(image_id)
+            ids_by_tag = ids_by_tag.items()
+        else:
+            # Tag ids index a list directly, no hashing
+            ids_lists = [[] for _ in tag_names]
+            appenders = [ids.append for ids in ids_lists]
+            for image_id, tags in tags_by_id:
+                for tag_id in tags:
+                    appenders[tag_id](image_id)
+                if tags:
+                    ids_by_count.setdefault(len(tags), []).append(image_id)
+            ids_by_tag = ((tag_names[tag_id], ids)
+                          for tag_id, ids in enumerate(ids_lists) if ids)
+        self.postings = {tag: bitmap_from_ids(ids) for tag, ids in ids_by_tag}
+        self.tag_counts = {
+            count: bitmap_from_ids(ids)
+            for count, ids in ids_by_count.items()
+        }
+        self.all_images = (1 << image_count) - 1
+
+    def update_image(self, image_id, old_tags, new_tags):
+        bit = 1 << image_id
+        for tag in old_tags - new_tags:
+            posting = self.postings.get(tag, 0) & ~bit
+            if posting:
+                self.postings[tag] = posting
+            else:
+                self.postings.pop(tag, None)
+        for tag in new_tags - old_tags:
+            self.postings[tag] = self.postings.get(tag, 0) | bit
+        if len(old_tags) != len(new_tags):
+            self.move_count(bit, len(old_tags), len(new_tags))
+
+    def move_count(self, bit, old_count, new_count):
+        if old_count:
+            posting = self.tag_counts.get(old_count, 0) & ~bit
+            if posting:
+                self.tag_counts[old_count] = posting
+            else:
+                self.tag_counts.pop(old_count, None)
+        if new_count:
+            self.tag_counts[new_count] = (self.tag_counts.get(new_count, 0)
+                                          | bit)
+
+    def tags(self):
+        return self.postings.keys()
+
+    def posting(self, tag):
+        return self.postings.get(tag, 0)
+
+    def union(self, tags):
+        bitmap = 0
+        for tag in tags:
+            bitmap |= self.postings.get(tag, 0)
+        return bitmap
+
+    def with_tag_count(self, predicate):
+        # Images whose number of tags satisfies predicate; untagged images
+        # are those in no count bitmap
+        bitmap = 0
+        tagged = 0
+        for count, posting in self.tag_counts.items():
+            tagged |= posting
+            if predicate(count):
+                bitmap |= posting
+        if predicate(0):
+            bitmap |= self.all_images & ~tagged
+        return bitmap
+
+    def filter(self, positive_tags, negative_tags):
+        # Any of the positive tags, and none of the negative ones
+        bitmap = self.all_images
+        if positive_tags:
+            bitmap = self.union(positive_tags)
+        if negative_tags:
+            bitmap &= ~self.union(negative_tags)
+        return bitmap
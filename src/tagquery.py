@@ -0,0 +1,192 @@
+import operator
+import re
+
+# Tokens of a query. Words run up to whitespace or an operator character;
+# tags holding those characters can be written in double quotes.
+_TOKEN = re.compile(
+    r'''\s*(?:
+    (?P<count>tags\s*(?:<=|>=|!=|==|<|>|=)\s*\d+)
+    |(?P<quoted>"(?:[^"\\]|\\.)*")
+    |(?P<op>[()&|!,])
+    |(?P<word>[^\s()&|!,"]+)
+    )''', re.VERBOSE)
+_COUNT = re.compile(r'tags\s*(<=|>=|!=|==|<|>|=)\s*(\d+)')
+_COMPARISONS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '=': operator.eq,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+_KEYWORDS = {'AND': '&', 'OR': '|', 'NOT': '!'}
+
+
+class QueryError(ValueError):
+    pass
+
+
+def _tokenize(text):
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if match is None:
+            raise QueryError(f"Unexpected character at {position + 1}")
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'word' and value in _KEYWORDS:
+            kind, value = 'op', _KEYWORDS[value]
+        elif kind == 'quoted':
+            value = re.sub(r'\\(.)', r'\1', value[1:-1])
+        tokens.append((kind, value))
+    return tokens
+
+
+def _glob(pattern):
+    # * matches any run of characters and ? a single one, nothing else is
+    # special so tags with brackets need no escaping
+    wildcards = {'*': '.*', '?': '.'}
+    regex = ''.join(
+        wildcards.get(part) or re.escape(part)
+        for part in re.split(r'([*?])', pattern))
+    return re.compile(regex, re.DOTALL)
+
+
+class TagQuery:
+    """Boolean query over image tags, evaluated on the TagIndex bitmaps.
+
+        long hair AND NOT (hat OR *_hat) AND tags>20
+
+    Operators are AND (&, or a comma), OR (|) and NOT (!, or a leading -),
+    with NOT binding tightest and AND before OR. Operands next to each
+    other without an operator are ANDed. Consecutive words form one tag,
+    so tags with spaces need no quotes; * and ? in a tag are wildcards
+    matched against the vocabulary, and tags<op>N compares the number of
+    tags of an image.
+
+    Every operand is one bitmap and every operator one big-int operation,
+    so evaluating is cheap even over a million images.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = _tokenize(text)
+        self.position = 0
+        self.tree = self.parse_or() if self.tokens else None
+        if self.position < len(self.tokens):
+            raise QueryError(f"Unexpected '{self.tokens[self.position][1]}'")
+        del self.tokens
+
+    # Recursive descent parser, producing nested tuples
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def advance(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def parse_or(self):
+        operands = [self.parse_and()]
+        while self.peek() == ('op', '|'):
+            self.advance()
+            operands.append(self.parse_and())
+        return operands[0] if len(operands) == 1 else ('or', operands)
+
+    def parse_and(self):
+        operands = [self.parse_not()]
+        while True:
+            kind, value = self.peek()
+            if (kind, value) in (('op', '&'), ('op', ',')):
+                self.advance()
+            elif kind is None or (kind, value) in (('op', '|'), ('op', ')')):
+                break
+            operands.append(self.parse_not())
+        return operands[0] if len(operands) == 1 else ('and', operands)
+
+    def parse_not(self):
+        kind, value = self.peek()
+        if (kind, value) == ('op', '!'):
+            self.advance()
+            return ('not', self.parse_not())
+        if kind == 'word' and value.startswith('-') and len(value) > 1:
+            # -tag is NOT tag; the rest of the word stays an operand
+            self.tokens[self.position] = ('word', value[1:])
+            return ('not', self.parse_not())
+        return self.parse_operand()
+
+    def parse_operand(self):
+        kind, value = self.advance()
+        if (kind, value) == ('op', '('):
+            tree = self.parse_or()
+            if self.advance() != ('op', ')'):
+                raise QueryError("Missing ')'")
+            return tree
+        if kind == 'count':
+            comparison, number = _COUNT.fullmatch(value).groups()
+            return ('count', comparison, int(number))
+        if kind == 'quoted':
+            return ('tag', value)
+        if kind == 'word':
+            words = [value]
+            while self.peek()[0] == 'word':
+                words.append(self.advance()[1])
+            tag = ' '.join(words)
+            if '*' in tag or '?' in tag:
+                return ('glob', tag)
+            return ('tag', tag)
+        if kind is None:
+            raise QueryError("Query ends where a tag was expected")
+        raise QueryError(f"Unexpected '{value}'")
+
+    # Evaluation
+
+    def evaluate(self, index, search_index=None):
+        """Bitmap of the image ids matching the query. search_index, a
+        TagSearchIndex, narrows the tags tried against wildcards."""
+        if self.tree is None:
+            return index.all_images
+        return self.evaluate_node(self.tree, index, search_index)
+
+    def evaluate_node(self, node, index, search_index):
+        kind = node[0]
+        if kind == 'tag':
+            return index.posting(node[1])
+        if kind == 'glob':
+            return index.union(self.expand(node[1], index, search_index))
+        if kind == 'count':
+            compare, number = _COMPARISONS[node[1]], node[2]
+            return index.with_tag_count(lambda count: compare(count, number))
+        if kind == 'not':
+            return index.all_images & ~self.evaluate_node(
+                node[1], index, search_index)
+        if kind == 'and':
+            bitmap = index.all_images
+            for operand in node[1]:
+                bitmap &= self.evaluate_node(operand, index, search_index)
+                if not bitmap:
+                    break
+            return bitmap
+        bitmap = 0
+        for operand in node[1]:
+            bitmap |= self.evaluate_node(operand, index, search_index)
+        return bitmap
+
+    @staticmethod
+    def expand(pattern, index, search_index=None):
+        # Tags matching a wildcard pattern. Its longest literal part, when
+        # long enough to have a trigram, gives the candidates.
+        literal = max(re.split(r'[*?]', pattern), key=len)
+        if search_index is not None and len(literal) >= 3:
+            candidates = search_index.search(literal)
+        else:
+            candidates = index.tags()
+        glob = _glob(pattern)
+        return [tag for tag in candidates if glob.fullmatch(tag)]
@@ -0,0 +1,50 @@
+GRAM_SIZE = 3
+
+
+def ngrams(text, size=GRAM_SIZE):
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class TagSearchIndex:
+    """Trigram index over the tag vocabulary for the tag filter boxes.
+
+    A tag contains the query only if it contains every trigram of the
+    query, so the candidates are the tags of the query's rarest trigram,
+    and only those are checked with a substring test. Queries shorter
+    than a trigram check the whole vocabulary.
+    """
+
+    def __init__(self):
+        self.tags = set()
+        self.postings = {}  # trigram -> set of tags
+
+    def clear(self):
+        self.tags.clear()
+        self.postings.clear()
+
+    def add(self, tag):
+        if tag in self.tags:
+            return
+        self.tags.add(tag)
+        for gram in ngrams(tag):
+            self.postings.setdefault(gram, set()).add(tag)
+
+    def discard(self, tag):
+        if tag not in self.tags:
+            return
+        self.tags.discard(tag)
+        for gram in ngrams(tag):
+            posting = self.postings.get(gram)
+            if posting is not None:
+                posting.discard(tag)
+                if not posting:
+                    del self.postings[gram]
+
+    def search(self, text):
+        grams = ngrams(text)
+        if grams:
+            candidates = min((self.postings.get(gram, ()) for gram in grams),
+                             key=len)
+        else:
+            candidates = self.tags
+        return {tag for tag in candidates if text in tag}
@@ -0,0 +1,53 @@
+from collections import Counter
+
+
+class TagStatistics:
+    """Number of images carrying each tag.
+
+    The counter is built once when captions are loaded and afterwards only
+    moved by the difference between an image's old and new tags, so an edit
+    costs as much as the tags it touches instead of a full recount.
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+
+    def set_counts(self, counts):
+        # Counts worked out elsewhere, e.g. TagTable.tag_counts()
+        self.counts = Counter(counts)
+
+    def apply_delta(self, old_tags, new_tags):
+        counts = self.counts
+        for tag in old_tags - new_tags:
+            counts[tag] -= 1
+            if counts[tag] <= 0:
+                del counts[tag]
+        for tag in new_tags - old_tags:
+            counts[tag] += 1
+
+    def apply_counts(self, deltas):
+        # {tag: change in its count}, for edits of many images at once
+        counts = self.counts
+        for tag, delta in deltas.items():
+            counts[tag] += delta
+            if counts[tag] <= 0:
+                del counts[tag]
+
+    def snapshot(self, specific_tag=None):
+        # Plain dict copy, safe to use as a sort key while counts keep moving
+        if specific_tag is not None:
+            count = self.counts.get(specific_tag, 0)
+            return {specific_tag: count} if count else {}
+        return dict(self.counts)
+
+    def verify(self, tag_sets):
+        """Compare against a full recount, return the mismatching tags as
+        {tag: (counted, expected)}."""
+        expected = Counter()
+        for tags in tag_sets:
+            expected.update(tags)
+        return {
+            tag: (self.counts.get(tag, 0), expected.get(tag, 0))
+            for tag in set(self.counts) | set(expected)
+            if self.counts.get(tag, 0) != expected.get(tag, 0)
+        }
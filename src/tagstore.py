@@ -0,0 +1,178 @@
+from array import array
+from collections import Counter
+
+_COMPACT_MIN = 1024  # Edited rows kept aside before folding them back
+
+
+class TagVocabulary:
+    """Interns tag strings to small integer ids, so every tag string is held
+    once however many images carry it."""
+
+    def __init__(self):
+        self.ids = {}  # tag -> id
+        self.tags = []  # id -> tag
+
+    def __len__(self):
+        return len(self.tags)
+
+    def clear(self):
+        self.ids.clear()
+        self.tags.clear()
+
+    def load(self, tags):
+        # Take over a stored vocabulary, so rows encoded with it stay valid
+        self.tags = list(tags)
+        self.ids = {tag: tag_id for tag_id, tag in enumerate(self.tags)}
+
+    def id_of(self, tag):
+        tag_id = self.ids.get(tag)
+        if tag_id is None:
+            tag_id = self.ids[tag] = len(self.tags)
+            self.tags.append(tag)
+        return tag_id
+
+    def encode(self, tags):
+        try:
+            # Known tags only, the common case, stays in C
+            tag_ids = map(self.ids.__getitem__, tags)
+            return array('I', sorted(tag_ids))
+        except KeyError:
+            return array('I', sorted(map(self.id_of, tags)))
+
+    def decode(self, row):
+        return set(map(self.tags.__getitem__, row))
+
+
+class TagTable:
+    """Tags of every image, stored as sorted tag ids.
+
+    Rows loaded together are packed CSR style, in one array('I') of tag ids
+    with an array of row offsets. Rows set afterwards are kept as separate
+    arrays until there are enough of them to fold back in. The mapping
+    interface takes and returns sets of tag strings, so only the UI and
+    file boundaries see strings.
+    """
+
+    def __init__(self):
+        self.vocabulary = TagVocabulary()
+        self.slots = {}  # image file -> row
+        # Row i is tag_ids[offsets[i]:offsets[i + 1]]
+        self.offsets = array('Q', [0])
+        self.tag_ids = array('I')
+        self.edited_rows = {}  # row -> array('I'), overrides the packed row
+
+    def encode(self, tags):
+        return self.vocabulary.encode(tags)
+
+    def decode(self, row):
+        return self.vocabulary.decode(row)
+
+    def load_rows(self, rows):
+        """Append (image_file, encoded row) pairs in one pass."""
+        for image_file, row in rows:
+            if image_file in self.slots:
+                self.set_row(image_file, row)
+                continue
+            self.slots[image_file] = len(self.offsets) - 1
+            self.tag_ids.extend(row)
+            self.offsets.append(len(self.tag_ids))
+
+    def row(self, image_file):
+        slot = self.slots[image_file]
+        edited = self.edited_rows.get(slot)
+        if edited is not None:
+            return edited
+        return self.tag_ids[self.offsets[slot]:self.offsets[slot + 1]]
+
+    def set_row(self, image_file, row):
+        slot = self.slots.get(image_file)
+        if slot is None:
+            self.load_rows(((image_file, row), ))
+            return
+        self.edited_rows[slot] = row
+
+    def maybe_compact(self):
+        # Called after a batch of edits, folds once a quarter of the rows
+        # has moved out of the packed arrays
+        if len(self.edited_rows) > max(_COMPACT_MIN, len(self.slots) // 4):
+            self.compact()
+
+    def compact(self):
+        # Fold the edited rows back into the packed arrays
+        if not self.edited_rows:
+            return
+        offsets = array('Q', [0])
+        tag_ids = array('I')
+        edited_rows = self.edited_rows
+        for slot in range(len(self.offsets) - 1):
+            row = edited_rows.get(slot)
+            if row is None:
+                row = self.tag_ids[self.offsets[slot]:self.offsets[slot + 1]]
+            tag_ids.extend(row)
+            offsets.append(len(tag_ids))
+        self.offsets = offsets
+        self.tag_ids = tag_ids
+        self.edited_rows = {}
+
+    def rows(self):
+        """(image_file, row of tag ids) pairs, without decoding."""
+        for image_file in self.slots:
+            yield image_file, self.row(image_file)
+
+    def tag_counts(self):
+        """Number of images carrying each tag, counted over the tag ids."""
+        # Counting the packed array runs in C; edited rows replace theirs
+        counts = Counter(self.tag_ids)
+        offsets = self.offsets
+        for slot, row in self.edited_rows.items():
+            counts.subtract(self.tag_ids[offsets[slot]:offsets[slot + 1]])
+            counts.update(row)
+        tags = self.vocabulary.tags
+        return Counter({
+            tags[tag_id]: count
+            for tag_id, count in counts.items() if count > 0
+        })
+
+    def close(self):
+        # Nothing to release, see SqliteTagTable.close()
+        pass
+
+    def clear(self):
+        self.vocabulary.clear()
+        self.slots.clear()
+        self.offsets = array('Q', [0])
+        self.tag_ids = array('I')
+        self.edited_rows = {}
+
+    # Mapping interface over sets of tag strings
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, image_file):
+        return image_file in self.slots
+
+    def __iter__(self):
+        return iter(self.slots)
+
+    def __getitem__(self, image_file):
+        return self.decode(self.row(image_file))
+
+    def __setitem__(self, image_file, tags):
+        self.set_row(image_file, self.encode(tags))
+
+    def get(self, image_file, default=None):
+        if image_file not in self.slots:
+            return default
+        return self[image_file]
+
+    def keys(self):
+        return self.slots.keys()
+
+    def items(self):
+        for image_file in self.slots:
+            yield image_file, self[image_file]
+
+    def values(self):
+        for image_file in self.slots:
+            yield self[image_file]
@@ -0,0 +1,150 @@
+import os
+import struct
+import hashlib
+import threading
+import tempfile
+
+from PyQt5.QtCore import QBuffer, QByteArray, QIODevice
+from PyQt5.QtGui import QImage
+
+try:
+    import zstandard
+except ImportError:  # Fall back to PNG entries without zstandard
+    zstandard = None
+
+_ZSTD_MAGIC = b"TZS1"
+_PNG_MAGIC = b"TPNG"
+_HEADER = struct.Struct("<4sIIII")  # magic, width, height, format, bytes/line
+_TRIM_EVERY = 64 * 1024 * 1024  # Check the size limit after this many bytes
+
+
+class ThumbnailDiskCache:
+    """Persistent store of pre-scaled thumbnails.
+
+    Entries are keyed by absolute path, thumbnail size, modification time and
+    file size, so an edited or replaced image simply misses and gets decoded
+    again. Pixels are stored raw and zstd compressed, which decodes much
+    faster than re-reading the source image. When the directory grows past
+    max_bytes the least recently used entries are deleted.
+
+    get() and put() are called from the thumbnail worker threads.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._written = _TRIM_EVERY  # Trim once on the first write
+        os.makedirs(directory, exist_ok=True)
+
+    def _entry_path(self, image_path, size, stat):
+        key = os.fsencode(os.path.abspath(image_path)) + (
+            f"\0{size}\0{stat.st_mtime_ns}\0{stat.st_size}".encode())
+        digest = hashlib.sha1(key).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest[2:])
+
+    def _compressor(self):
+        if not hasattr(self._local, "compressor"):
+            self._local.compressor = zstandard.ZstdCompressor(level=3)
+            self._local.decompressor = zstandard.ZstdDecompressor()
+        return self._local.compressor, self._local.decompressor
+
+    def get(self, image_path, size, stat):
+        entry_path = self._entry_path(image_path, size, stat)
+        try:
+            with open(entry_path, "rb") as file:
+                data = file.read()
+            os.utime(entry_path)  # Mark as recently used for eviction
+        except OSError:
+            return None
+        try:
+            return self._decode(data)
+        except Exception:
+            return None
+
+    def put(self, image_path, size, stat, image):
+        entry_path = self._entry_path(image_path, size, stat)
+        data = self._encode(image)
+        try:
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(entry_path))
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.replace(temp_path, entry_path)
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            self._written += len(data)
+            if self._written < _TRIM_EVERY:
+                return
+            self._written = 0
+        self.trim()
+
+    def _encode(self, image):
+        if zstandard is None:
+            buffer = QBuffer()
+            buffer.open(QIODevice.WriteOnly)
+            image.save(buffer, "PNG")
+            return _HEADER.pack(_PNG_MAGIC, 0, 0, 0, 0) + bytes(buffer.data())
+        if image.format() not in (QImage.Format_RGB32, QImage.Format_ARGB32,
+                                  QImage.Format_ARGB32_Premultiplied):
+            target_format = QImage.Format_RGB32
+            if image.hasAlphaChannel():
+                target_format = QImage.Format_ARGB32
+            image = image.convertToFormat(target_format)
+        compressor, _ = self._compressor()
+        pixels = image.constBits().asstring(image.sizeInBytes())
+        return _HEADER.pack(_ZSTD_MAGIC, image.width(), image.height(),
+                            image.format(),
+                            image.bytesPerLine()) + compressor.compress(pixels)
+
+    def _decode(self, data):
+        header = _HEADER.unpack_from(data)
+        magic, width, height, image_format, bytes_per_line = header
+        payload = data[_HEADER.size:]
+        if magic == _PNG_MAGIC:
+            image = QImage()
+            image.loadFromData(QByteArray(payload), "PNG")
+            return None if image.isNull() else image
+        if magic != _ZSTD_MAGIC or zstandard is None:
+            return None
+        _, decompressor = self._compressor()
+        pixels = decompressor.decompress(payload)
+        # copy() detaches the image from the temporary pixel buffer
+        return QImage(pixels, width, height, bytes_per_line,
+                      QImage.Format(image_format)).copy()
+
+    def trim(self):
+        entries = []
+        total = 0
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        # Evict least recently used entries down to 90% of the limit
+        entries.sort()
+        target = self.max_bytes * 9 // 10
+        for _, entry_size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= entry_size
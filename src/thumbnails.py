@@ -0,0 +1,135 @@
+import os
+
+from PyQt5.QtCore import (QObject, QRunnable, QThread, QThreadPool, Qt,
+                          pyqtSignal)
+from PyQt5.QtGui import QImage, QImageReader
+
+import perf
+
+# Thumbnails are decoded at one of these sizes and scaled to the slider value
+# when painted, so any slider position reuses an already decoded level
+MIP_LEVELS = (128, 256, 512, 1024, 2048)
+
+
+def mip_level(size):
+    for level in MIP_LEVELS:
+        if size <= level:
+            return level
+    return MIP_LEVELS[-1]
+
+
+def read_scaled(image_path, size):
+    """Decode image_path so that it fits in a size x size box.
+
+    The reader is asked for the reduced size up front, which lets the JPEG
+    plugin scale in the DCT domain instead of materialising the full
+    resolution bitmap. Images already smaller than the box are read as is.
+    """
+    reader = QImageReader(image_path)
+    reader.setAutoTransform(True)
+    original_size = reader.size()
+    if original_size.isValid() and (original_size.width() > size
+                                    or original_size.height() > size):
+        reader.setScaledSize(
+            original_size.scaled(size, size, Qt.KeepAspectRatio))
+    return reader.read()
+
+
+class ThumbnailTask(QRunnable):
+    """Decodes and scales one image on a worker thread."""
+
+    def __init__(self, loader, generation, image_path, size, source=None):
+        super().__init__()
+        self.loader = loader
+        self.generation = generation
+        self.image_path = image_path
+        self.size = size
+        self.source = source  # Already decoded larger level to scale down
+
+    def run(self):
+        # Skip work that was queued before the last cancel()
+        if self.generation != self.loader.generation:
+            return
+        with perf.span("decode", size=self.size):
+            if self.source is None:
+                thumbnail = self.load(self.loader.disk_cache)
+            else:
+                perf.count("thumbnails.scaled_from_cache")
+                thumbnail = self.source.scaled(self.size, self.size,
+                                               Qt.KeepAspectRatio,
+                                               Qt.SmoothTransformation)
+        if thumbnail.isNull():
+            return
+        if self.generation != self.loader.generation:
+            return
+        self.loader._decoded.emit(self.generation, self.image_path, self.size,
+                                  thumbnail)
+
+    def load(self, disk_cache):
+        if disk_cache is None:
+            return read_scaled(self.image_path, self.size)
+        try:
+            stat = os.stat(self.image_path)
+        except OSError:
+            return QImage()
+        image = disk_cache.get(self.image_path, self.size, stat)
+        if image is None:
+            perf.count("thumbnail_disk_cache.misses")
+            image = read_scaled(self.image_path, self.size)
+            if not image.isNull():
+                disk_cache.put(self.image_path, self.size, stat, image)
+        else:
+            perf.count("thumbnail_disk_cache.hits")
+        return image
+
+
+class ThumbnailLoader(QObject):
+    """Thumbnail pipeline running on a QThreadPool.
+
+    Results are posted back to the GUI thread through thumbnail_loaded.
+    cancel() drops everything that is still queued and discards results of
+    tasks that are already running, so a folder change or a slider move never
+    delivers stale thumbnails.
+    """
+
+    # image_path, requested size, thumbnail fitting in a size x size box
+    thumbnail_loaded = pyqtSignal(str, int, QImage)
+    _decoded = pyqtSignal(int, str, int, QImage)
+
+    def __init__(self, workers=0, disk_cache=None, parent=None):
+        super().__init__(parent)
+        self.generation = 0
+        self.disk_cache = disk_cache
+        self.pending = set()  # (image_path, size) queued or being decoded
+        self.requests = 0
+        self.pool = QThreadPool(self)
+        self.set_worker_count(workers)
+        self._decoded.connect(self._on_decoded, Qt.QueuedConnection)
+
+    def set_worker_count(self, workers):
+        if workers <= 0:
+            workers = QThread.idealThreadCount()
+        self.pool.setMaxThreadCount(max(1, workers))
+
+    def is_pending(self, image_path, size):
+        return (image_path, size) in self.pending
+
+    def request(self, image_path, size, source=None):
+        if (image_path, size) in self.pending:
+            return
+        self.pending.add((image_path, size))
+        # Newer requests run first: they are for what is on screen right now
+        self.requests += 1
+        self.pool.start(
+            ThumbnailTask(self, self.generation, image_path, size, source),
+            self.requests % 0x7fffffff)
+
+    def cancel(self):
+        self.generation += 1
+        self.pool.clear()
+        self.pending.clear()
+
+    def _on_decoded(self, generation, image_path, size, thumbnail):
+        if generation == self.generation:
+            self.pending.discard((image_path, size))
+            self.thumbnail_loaded.emit(image_path, size, thumbnail)
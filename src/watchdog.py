@@ -0,0 +1,112 @@
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+from PyQt5.QtCore import QObject, QTimer
+
+import perf
+
+log = logging.getLogger(__name__)
+
+_MAX_SAMPLES = 100  # Stack samples kept per stall
+_STACK_DEPTH = 40  # Innermost frames kept per sample
+_HANG_REPORT_AFTER = 5.0  # Seconds before a stall is reported while ongoing
+
+
+def _stack(frame):
+    return tuple(
+        traceback.format_list(traceback.extract_stack(frame)[-_STACK_DEPTH:]))
+
+
+class StallWatchdog(QObject):
+    """Reports when the GUI thread stops turning over its event loop.
+
+    A timer on the GUI thread beats every quarter of the threshold. A
+    daemon thread checks the beats; once none came for threshold_ms, it
+    samples the GUI thread's Python stack through sys._current_frames()
+    every quarter of the threshold until the loop runs again. The next
+    beat then logs a warning with the stall's duration and its stacks,
+    most sampled first, so the slot that blocked shows on top.
+
+    A stall that lasts more than a few seconds is also reported while it
+    goes on, in case the app never recovers. Sampling needs the GIL, so a
+    single long call into C is seen once it returns.
+    """
+
+    def __init__(self, threshold_ms=200, parent=None):
+        super().__init__(parent)
+        self.threshold = threshold_ms / 1000
+        self.interval = self.threshold / 4
+        self.gui_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.samples = []  # Stacks sampled during the current stall
+        self.hang_reported = False
+        self.running = threading.Event()
+        self.thread = None
+        self.heartbeat = QTimer(self)
+        self.heartbeat.setInterval(max(1, int(threshold_ms / 4)))
+        self.heartbeat.timeout.connect(self.beat)
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.last_beat = time.monotonic()
+        self.running.set()
+        self.thread = threading.Thread(target=self.watch,
+                                       name="StallWatchdog",
+                                       daemon=True)
+        self.thread.start()
+        self.heartbeat.start()
+
+    def stop(self):
+        self.heartbeat.stop()
+        self.running.clear()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def beat(self):
+        # On the GUI thread, between two slots
+        now = time.monotonic()
+        stalled = now - self.last_beat - self.interval
+        samples = self.samples
+        self.samples = []
+        self.hang_reported = False
+        self.last_beat = now
+        if stalled >= self.threshold and samples:
+            perf.count("gui.stalls")
+            self.report(f"GUI thread stalled for {stalled * 1000:.0f} ms",
+                        stalled, samples)
+
+    def watch(self):
+        # On the watchdog thread
+        while self.running.is_set():
+            time.sleep(self.interval)
+            last_beat = self.last_beat
+            stalled = time.monotonic() - last_beat - self.interval
+            if stalled < self.threshold:
+                continue
+            frame = sys._current_frames().get(self.gui_thread_id)
+            if frame is None:  # GUI thread gone, the app is exiting
+                break
+            if len(self.samples) < _MAX_SAMPLES:
+                self.samples.append(_stack(frame))
+            del frame
+            if stalled >= _HANG_REPORT_AFTER and not self.hang_reported:
+                self.hang_reported = True
+                self.report(
+                    f"GUI thread stalled for {stalled:.1f} s and counting",
+                    stalled, list(self.samples))
+
+    def report(self, message, stalled, samples):
+        stacks = Counter(samples).most_common()
+        text = "".join(f"\n{count} of {len(samples)} samples:\n" +
+                       "".join(stack) for stack, count in stacks)
+        stack_fields = [
+            dict(samples=count, stack=list(stack)) for stack, count in stacks
+        ]
+        fields = dict(stall_ms=round(stalled * 1000, 1), stacks=stack_fields)
+        log.warning("%s%s", message, text, extra=fields)